@@ -5,70 +5,58 @@ import sys
 
 sys.path.append('replication_code')
 
+import argparse
+import datetime
 import os
-from sklearn.feature_extraction.text import TfidfVectorizer
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
 from sklearn.metrics import normalized_mutual_info_score
-from sklearn.naive_bayes import MultinomialNB
 from replication_code import load
+from replication_code import counts
+from replication_code import descriptors
 from replication_code import figures
+from replication_code import tables
+from replication_code.pipeline import Pipeline, Stage
 
 from replication_code.config import CLIENT_ID_COL, BILL_ID_COL
 
+# The data files and directories read by each table loader (see load._dataset)
+POSITIONS_FILES = ('data/positions.parquet', f'{load.PARTITIONED_ROOT}/positions')
+CLIENTS_FILES = ('data/clients.parquet', f'{load.PARTITIONED_ROOT}/clients')
+BILLS_FILES = ('data/bills.parquet', f'{load.PARTITIONED_ROOT}/bills')
+WI_BLOCKSTATE_FILES = (load.blockstate_path('WI', 'lobbying'),)
+BLOCKSTATE_FILES = tuple(load.blockstate_path(state, record_type) for state, record_type in load.BLOCKSTATE_KEYS)
+FIGURE_6_REGIONS = [
+    ('CO', 'lobbying', 1),
+    ('TX', 'testimony', 0),
+    ('IL', 'testimony', 1),
+    ('MA', 'lobbying', 1)]
 
 
-import importlib
+def _figure_outputs(name):
+    return (f'figures/{name}.png', f'figures/{name}.pdf')
 
 
-def main():
-    currpath: pathlib.Path = pathlib.Path.cwd()
+def _save_figure(fig, name):
+    fig.savefig(f'figures/{name}.png', bbox_inches='tight', dpi=300)
+    fig.savefig(f'figures/{name}.pdf', bbox_inches='tight')
+    plt.close(fig)
 
-    # if we're inside the replication_code folder, move up one level
-    if currpath.name == 'replication_code':
-        os.chdir('..')
-        currpath = pathlib.Path.cwd()
 
-    # if '/figures' is not in the current directory, add it
-    if not (currpath / 'figures').exists():
-        (currpath / 'figures').mkdir()
+################
+### Data ###
+################
 
-    if not (currpath / 'tables').exists():
-        (currpath / 'tables').mkdir()
+def block_assignments_stage():
+    # make dataframe of block assignments from blockstates, recomputing only the slices whose blockstate changed
+    return load.materialize_block_assignments(load.blockstates())
 
-    if not (currpath / 'data').exists():
-        (currpath / 'data').mkdir()
-
-    from replication_code.hbsbm import get_bipartite_adjacency_matrix
-
-    """Load all position, bill, client data"""
-    positions, clients, bills = load.positions(), load.clients(), load.bills()
-    blockstates = load.blockstates()
-
-    # make dataframe of block assignments from blockstates
-    if not (currpath / 'data/block_assignments.parquet').exists():
-        block_assignments = pd.DataFrame()
-        for state, record_type in blockstates.keys():
-            blockstate = blockstates[(state, record_type)]
-            blocks = {level: dict(zip(
-                blockstate.g.vp.name,
-                blockstate.project_partition(level, 0)
-            )) for level in range(len(blockstate.levels))}
-            blocks_df = pd.DataFrame(blocks)
-            blocks_df['state'] = state
-            blocks_df['record_type'] = record_type
-            blocks_df.index.name = 'entity_id'
-            blocks_df = blocks_df.reset_index(drop=False)
-
-            # add state to entity_id because blockmodels were run separately for each state
-            # and did not use unique entity_ids across states
-            blocks_df['entity_id'] = blocks_df.state + '_' + blocks_df['entity_id'].astype(str)
-            block_assignments = pd.concat([block_assignments, blocks_df], axis=0, ignore_index=True)
-        block_assignments.to_parquet('data/block_assignments.parquet', index=False)
-    else:
-        block_assignments = load.block_assignments()
 
+def wi_block_levels_stage():
     """Load Wisconsin data"""
-    wi_blockstate = blockstates[('WI', 'lobbying')]
-    wi_positions = positions[positions.state == 'WI']
+    wi_blockstate = load.blockstates()[('WI', 'lobbying')]
 
     wi_graph = wi_blockstate.g
     wi_block_levels = pd.DataFrame({
@@ -76,43 +64,33 @@ def main():
         for l in range(len(wi_blockstate.levels))
     }).applymap(lambda l: f"wi{l}")
     wi_block_levels.index = 'WI_' + wi_block_levels.index.astype(str)
+    return wi_block_levels
+
+
+def wi_clients_stage(wi_block_levels):
+    clients = load.clients()
+    return load.join_block_levels(clients[clients.state == 'WI'], CLIENT_ID_COL, wi_block_levels)
+
 
-    wi_clients = clients[clients.state == 'WI'].copy()
-    wi_bills = bills[bills.state == 'WI'].copy()
+def wi_bills_stage(wi_block_levels):
+    bills = load.bills()
+    return load.join_block_levels(bills[bills.state == 'WI'], BILL_ID_COL, wi_block_levels)
 
-    for level in range(0, len(wi_blockstate.levels)):
-        wi_bills[f'block_level_{level}'] = wi_bills[BILL_ID_COL].map(wi_block_levels[level])
-        wi_clients[f'block_level_{level}'] = wi_clients[CLIENT_ID_COL].map(wi_block_levels[level])
 
-    ### Tables ###
+################
+### Tables ###
+################
 
+def table_1_stage():
     """Table 1: Summary statistics"""
-    n_positions = positions.groupby(['state', 'record_type']).position_numeric.value_counts().unstack()
-    percent_neutral = (n_positions.apply(lambda p: p[0] / sum(p), 1) * 100).round(1)
-    avg_per_bill = positions.groupby(['state', 'record_type']).apply(
-        lambda p: len(p) / p[BILL_ID_COL].nunique()).round(1)
-    years_covered = positions.groupby(['state', 'record_type']).year.apply(lambda y: f"{min(y)}-{max(y)}")
-
-    chamber_map = {
-        'S': 'Senate',
-        'H': 'House',
-        'A': 'Assembly',
-        'L': 'Unicameral'
-    }
-
-    # extract prefix from bill_id, map to chamber, and then group by state and record_type
-    positions['unified_prefix'] = positions[BILL_ID_COL].str.split('_').str[1]
-
-    positions['chamber'] = positions.unified_prefix.str[0].map(chamber_map)
-    chambers_covered = positions.groupby(['state', 'record_type']).chamber.apply(
-        lambda chambers: sorted({c for c in chambers.unique() if sum(chambers == c) > 100})).map(', '.join)
-
-    table_1 = pd.concat([n_positions, percent_neutral, avg_per_bill, years_covered, chambers_covered], axis=1)
+    table_1 = tables.summary_statistics(load.positions(), ['state', 'record_type'])
     table_1.columns = ['Support', 'Neutral', 'Oppose', '% Neutral', 'Average positions per bill', 'Years covered',
                        'Chambers covered']
     table_1.index.names = ['State', 'Record Type']
     table_1.to_excel('tables/summary_statistics.xlsx')
 
+
+def table_2_stage(wi_clients):
     """Table 2: Example block"""
     level_0_block_sizes = wi_clients.drop_duplicates(CLIENT_ID_COL).block_level_0.value_counts()
     highlighted_client_block = level_0_block_sizes.index[0]
@@ -122,34 +100,13 @@ def main():
     table_2.columns = ['Interest Group', 'Industry']
     table_2.to_excel('tables/wi_example_client_block.xlsx', index=False)
 
-    """Table 3: Words predictive of block membership"""
-
-    def get_bill_block_words(bill_table, level, naivebayesclass=MultinomialNB):
-        bill_table = bill_table[bill_table[level].notna()]
-
-        tfidf = TfidfVectorizer()
-
-        X = tfidf.fit_transform(bill_table.title.replace(np.nan, ''))
-        y = bill_table[level]
-
-        nb = naivebayesclass()
-
-        nb.fit(X, y)
-
-        bill_category_loadings = pd.DataFrame(
-            nb.predict_proba(tfidf.transform(tfidf.get_feature_names_out())),
-            index=tfidf.get_feature_names_out(),
-            columns=nb.classes_)
-
-        bill_category_loadings = bill_category_loadings.div(bill_category_loadings.sum(0), 1)
-
-        return bill_category_loadings.T
 
-    bill_category_loadings = {level: get_bill_block_words(wi_bills, f'block_level_{level}') for level in
-                              range(len(wi_blockstate.levels))}
+def table_3_stage(wi_bills):
+    """Table 3: Words predictive of block membership"""
+    wi_descriptors = descriptors.BlockDescriptors(wi_bills)
 
     level = 3
-    top_words = bill_category_loadings[level].apply(lambda r: ', '.join(r.nlargest(5).index.values), 1)
+    top_words = wi_descriptors.top_words(level)
     n_bills = wi_bills[f'block_level_{level}'].value_counts()
     pct_passed = wi_bills.groupby(f'block_level_{level}').apply(
         lambda b: (b.status.isin([4, 5]).sum() / b.status.notna().sum()))
@@ -158,84 +115,69 @@ def main():
     table_3.columns = ['N', '% passed', 'top descriptors']
     table_3.to_excel('tables/wi_high_level_bill_categories.xlsx')
 
-    """Table 4 and 5: entropy of bills and clients"""
-    # Calculate average entropy for members of each industry
 
+def table_4_stage(wi_clients, wi_bills):
+    """Table 4: entropy of bills"""
     client_block_level_0 = wi_clients.set_index(CLIENT_ID_COL).block_level_0.to_dict()
-    bill_block_level_0 = wi_bills.set_index(BILL_ID_COL).block_level_0.to_dict()
-    wi_matrix = wi_positions.pivot_table('position_numeric', CLIENT_ID_COL, BILL_ID_COL,
-                                         lambda x: int(any(x.notna())))
-
-    def entropy(x):
-        """
-        Calculate entropy of a vector of counts
-        :param x:
-        :return:
-        """
-        x = np.array(x)
-        x = x[x > 0]
-        x = x / x.sum()
-        return -sum(x * np.log(x))
-
-    bill_client_cts = wi_matrix.groupby(client_block_level_0).sum()
-    bill_client_cts = bill_client_cts.loc[:, bill_client_cts.sum(0) > 0]
-    bill_entropy = bill_client_cts.apply(entropy).sort_values()[::-1]
-    bill_entropy.name = 'bill_entropy'
+    bill_entropy = tables.block_entropy(load.positions(state='WI'), client_block_level_0, 'bill')
     bill_entropy_table = wi_bills[wi_bills.legiscan_bill.notna()].set_index(BILL_ID_COL)[['title']].join(
         bill_entropy).dropna()
     bill_entropy_table = bill_entropy_table.sort_values('bill_entropy').drop_duplicates('title')
     pd.concat([bill_entropy_table[::-1][:5], bill_entropy_table[:5]]).to_excel('tables/bill_entropy.xlsx')
 
-    client_bill_cts = wi_matrix.T.groupby(bill_block_level_0).sum()
-    client_bill_cts = client_bill_cts.loc[:, client_bill_cts.sum(0) > 0]
-    client_entropy = client_bill_cts.apply(entropy).sort_values()[::-1]
-    client_entropy.name = 'client_entropy'
+
+def table_5_stage(wi_clients, wi_bills):
+    """Table 5: entropy of clients"""
+    bill_block_level_0 = wi_bills.set_index(BILL_ID_COL).block_level_0.to_dict()
+    client_entropy = tables.block_entropy(load.positions(state='WI'), bill_block_level_0, 'client')
     client_entropy_table = wi_clients.drop_duplicates(CLIENT_ID_COL).set_index(CLIENT_ID_COL)[['client_name']].join(
         client_entropy).dropna()
     client_entropy_table = client_entropy_table.sort_values('client_entropy')
     pd.concat([client_entropy_table[::-1][:5], client_entropy_table[:5]]).to_excel('tables/client_entropy.xlsx')
 
 
-    # Clean up memory
-    del bill_client_cts, client_bill_cts, wi_matrix
-    del bill_entropy, client_entropy, bill_entropy_table, client_entropy_table
-    del bill_category_loadings, top_words, n_bills, pct_passed
-    del table_3, table_2, table_1
+################
+### Figures ###
+################
 
-    ################
-    ### Figures ###
-    ################
+def record_counts_stage():
+    # the record counts for figures 1 and 2 are accumulated over batches, so they do not need the positions in RAM
+    return counts.RecordCounts.from_batches(load.iter_positions(columns=counts.COUNT_COLUMNS))
 
+
+def figure_1_stage(record_counts):
     """Figure 1: Histogram of records per year"""
-    records_per_year = positions[
-        positions[CLIENT_ID_COL].notna() &
-        (positions.year < 2022)].groupby(['record_type', 'year']).position_numeric.count().unstack().T
+    fig = figures.figure_1_records_per_year(record_counts.records_per_year)
+    _save_figure(fig, 'figure_1_histogram')
 
-    fig = figures.figure_1_records_per_year(records_per_year)
-    fig.savefig('figures/figure_1_histogram.png', bbox_inches='tight', dpi=300)
-    fig.savefig('figures/figure_1_histogram.pdf', bbox_inches='tight')
 
+def figure_2_stage(record_counts):
     """Figure 2: Histogram of records per bill and per client"""
-    records_per_bill = positions[[BILL_ID_COL, 'record_type']].value_counts().unstack()
+    records_per_bill = record_counts.records_per_bill
     records_per_bill_hist = records_per_bill.apply(lambda c: 2 ** (np.round(np.log2(c)))).apply(
         lambda c: c.value_counts())
-    records_per_client = positions[[CLIENT_ID_COL, 'record_type']].value_counts().unstack()
+    records_per_client = record_counts.records_per_client
     records_per_client_hist = records_per_client.apply(lambda c: 2 ** (round(np.log2(c)))).apply(
         lambda c: c.value_counts())
 
     fig = figures.figure_2_histogram(records_per_bill_hist, records_per_client_hist)
-    fig.savefig('figures/figure_2_histogram.png', bbox_inches='tight', dpi=300)
-    fig.savefig('figures/figure_2_histogram.pdf', bbox_inches='tight')
+    _save_figure(fig, 'figure_2_histogram')
+
 
+def figure_3_stage():
     """Figure 3: Wisconsin blockmodel"""
-    figures.figure_3_blockmodel(wi_blockstate)
+    figures.figure_3_blockmodel(load.blockstates()[('WI', 'lobbying')])
     # this does not return a matplotlib figure, but rather saves a file
 
+
+def figure_4_stage(wi_block_levels, wi_clients):
     """Figure 4: interest group-level projection of the Wisconsin blockmodel"""
-    fig = figures.figure_4_blockmodel_projection(wi_positions, wi_block_levels, wi_clients, block_level=3)
-    fig.savefig('figures/figure_4_blockmodel_projection.png', bbox_inches='tight', dpi=300)
-    fig.savefig('figures/figure_4_blockmodel_projection.pdf', bbox_inches='tight')
+    fig = figures.figure_4_blockmodel_projection(load.positions(state='WI'), wi_block_levels, wi_clients,
+                                                 block_level=3)
+    _save_figure(fig, 'figure_4_blockmodel_projection')
 
+
+def figure_5a_stage(wi_block_levels, wi_clients):
     """Figure 5a: NMI for known and guessed industry labels in the Wisconsin blockmodel for each level of the hierarchy"""
     # Get all clients with known industry labels and block memberships
     known_ftm_sample = wi_clients[
@@ -252,14 +194,15 @@ def main():
     # Compute NMI for each level of the hierarchy between the block memberships and the known and guessed industry labels
     known_nmi = {}
     guessed_nmi = {}
-    for l in range(len(wi_blockstate.levels)):
+    for l in wi_block_levels.columns:
         known_nmi[l] = normalized_mutual_info_score(known_ftm_sample.ftm_industry, known_ftm_sample[f'block_level_{l}'])
         guessed_nmi[l] = normalized_mutual_info_score(guessed_sample.ftm_industry, guessed_sample[f'block_level_{l}'])
 
     fig, ax = figures.figure_5_nmi_a(known_nmi, known_ftm_sample, guessed_nmi, guessed_sample)
-    fig.savefig('figures/figure_5a_industry_nmi.pdf', bbox_inches='tight')
-    fig.savefig('figures/figure_5a_industry_nmi.png', bbox_inches='tight', dpi=300)
+    _save_figure(fig, 'figure_5a_industry_nmi')
+
 
+def figure_5b_stage(wi_block_levels, wi_bills):
     """Figure 5b: NMI for known and guessed issue labels in the Wisconsin blockmodel for each level of the hierarchy"""
     # Get all bills with metatopics and block memberships
     wi_bills_sample = wi_bills[
@@ -274,35 +217,33 @@ def main():
         ].drop_duplicates(BILL_ID_COL)
 
     topic_nmi = {}
-    for l in range(len(wi_blockstate.levels)):
+    for l in wi_block_levels.columns:
         topic_nmi[l] = normalized_mutual_info_score(wi_bills_with_topics.ncsl_topics.apply(lambda x: x.split(', ')[-1]),
                                                     wi_bills_with_topics[f'block_level_{l}'])
 
     meta_topic_nmi = {}
-    for l in range(len(wi_blockstate.levels)):
+    for l in wi_block_levels.columns:
         meta_topic_nmi[l] = normalized_mutual_info_score(
             wi_bills_sample.ncsl_metatopics.apply(lambda x: x.split(', ')[0]),
             wi_bills_sample[f'block_level_{l}'])
 
     fig = figures.figure_5_nmi_b(topic_nmi, wi_bills_with_topics, meta_topic_nmi, wi_bills_sample)
-    fig.savefig('figures/figure_5b_topic_nmi.pdf', bbox_inches='tight')
-    fig.savefig('figures/figure_5b_topic_nmi.png', bbox_inches='tight', dpi=300)
+    _save_figure(fig, 'figure_5b_topic_nmi')
 
-    """Figure 6: client-level projection of blockstates for lobbying/testimony on energy and climate bills in four 
+
+def figure_6_stage(block_assignments):
+    """Figure 6: client-level projection of blockstates for lobbying/testimony on energy and climate bills in four
     states """
+    from replication_code.hbsbm import get_bipartite_adjacency_matrix
 
     adj_matrices = []
     block_names_list = []
 
-    for region, record_type, level in [
-        ('CO', 'lobbying', 1),
-        ('TX', 'testimony', 0),
-        ('IL', 'testimony', 1),
-        ('MA', 'lobbying', 1)]:
+    for region, record_type, level in FIGURE_6_REGIONS:
 
         label_column = f'block_level_{level}'
 
-        region_positions = positions[positions.state == region.upper()].copy()
+        region_positions = load.positions(state=region.upper())
 
         region_block_assignments = block_assignments[
             (block_assignments.state == region.upper()) & (block_assignments.record_type == record_type)].copy()
@@ -318,13 +259,7 @@ def main():
 
         if not os.path.exists(f'data/{region.upper()}_network_figure_clusters_named.csv'):
 
-            region_clients = clients[clients.state == region.upper()].copy()
-            region_bills = bills[bills.state == region.upper()].copy()
-            n_levels = region_block_assignments.dropna(axis=1).shape[1]
-
-            for l in range(n_levels):
-                region_bills[f'block_level_{l}'] = region_bills[BILL_ID_COL].map(region_block_assignments[l])
-                region_clients[f'block_level_{l}'] = region_clients[CLIENT_ID_COL].map(region_block_assignments[l])
+            region_clients = load.clients_with_blocks(region.upper(), record_type)
 
             block_names = region_clients.set_index(CLIENT_ID_COL)[label_column].astype(str).to_dict()
 
@@ -350,10 +285,103 @@ def main():
         adj_matrices.append(adj_matrix)
         block_names_list.append(block_names)
 
-    importlib.reload(figures)
     # Note that figure 6 required manual editing of the output of the above code in order to fit the figure shown in the
     # paper. The code above produces the data used to generate the figure, but the figure itself was manually edited.
     fig = figures.figure_6_energy_positions(adj_matrices, block_names_list, ['CO', 'TX', 'IL', 'MA'])
+    _save_figure(fig, 'figure_6_energy_positions')
+
+
+# The stages of main(), with the stages and data files each one reads and the files it writes. Stage results are
+# cached in data/pipeline_cache, keyed on a hash of the stage code, its data files and its input stages.
+STAGES = [
+    Stage('block_assignments', block_assignments_stage, files=BLOCKSTATE_FILES,
+          outputs=('data/block_assignments.parquet',)),
+    Stage('wi_block_levels', wi_block_levels_stage, files=WI_BLOCKSTATE_FILES),
+    Stage('wi_clients', wi_clients_stage, ('wi_block_levels',), CLIENTS_FILES),
+    Stage('wi_bills', wi_bills_stage, ('wi_block_levels',), BILLS_FILES),
+    Stage('table_1', table_1_stage, files=POSITIONS_FILES, outputs=('tables/summary_statistics.xlsx',)),
+    Stage('table_2', table_2_stage, ('wi_clients',), outputs=('tables/wi_example_client_block.xlsx',)),
+    Stage('table_3', table_3_stage, ('wi_bills',), outputs=('tables/wi_high_level_bill_categories.xlsx',)),
+    Stage('table_4', table_4_stage, ('wi_clients', 'wi_bills'), POSITIONS_FILES, ('tables/bill_entropy.xlsx',)),
+    Stage('table_5', table_5_stage, ('wi_clients', 'wi_bills'), POSITIONS_FILES, ('tables/client_entropy.xlsx',)),
+    Stage('record_counts', record_counts_stage, files=POSITIONS_FILES),
+    Stage('figure_1', figure_1_stage, ('record_counts',), outputs=_figure_outputs('figure_1_histogram')),
+    Stage('figure_2', figure_2_stage, ('record_counts',), outputs=_figure_outputs('figure_2_histogram')),
+    Stage('figure_3', figure_3_stage, files=WI_BLOCKSTATE_FILES,
+          outputs=('figures/figure_3_blockmodel_spaghetti.png',)),
+    Stage('figure_4', figure_4_stage, ('wi_block_levels', 'wi_clients'), POSITIONS_FILES,
+          _figure_outputs('figure_4_blockmodel_projection')),
+    Stage('figure_5a', figure_5a_stage, ('wi_block_levels', 'wi_clients'),
+          outputs=_figure_outputs('figure_5a_industry_nmi')),
+    Stage('figure_5b', figure_5b_stage, ('wi_block_levels', 'wi_bills'),
+          outputs=_figure_outputs('figure_5b_topic_nmi')),
+    Stage('figure_6', figure_6_stage, ('block_assignments',),
+          POSITIONS_FILES + CLIENTS_FILES + tuple(
+              f'data/{region}_network_figure_clusters_named.csv' for region, _, _ in FIGURE_6_REGIONS),
+          _figure_outputs('figure_6_energy_positions') + tuple(
+              # the unnamed cluster lists are only written for the regions without a named one
+              f'data/{region}_network_figure_clusters.csv' for region, _, _ in FIGURE_6_REGIONS
+              if not os.path.exists(f'data/{region}_network_figure_clusters_named.csv'))),
+]
+
+# The code the stages run: this script (with its helpers and constants) and every module of replication_code. A
+# change to any of these reruns all stages.
+CODE_FILES = (__file__, *sorted(
+    str(path) for path in (pathlib.Path(__file__).parent / 'replication_code').glob('*.py')))
+
+def main(only=None, force=False, jobs=1, profile=False, trace_memory=False, cprofile=False):
+    """
+    Produce the tables and figures of the paper, rerunning only the stages whose code or data changed
+    :param only: the names of the stages to produce (e.g. ['figure_6']); defaults to all stages
+    :param force: if True, rerun the stages in only (or all stages) even if their results are cached
+    :param jobs: the number of stages to run in parallel processes
+    :param profile: if True, record the wall time, CPU time, RSS and dataframe sizes of each stage and of the
+        profiled functions of load, hbsbm and figures, and write them to data/profiles/{time}/report.json and .csv
+    :param trace_memory: if True (with profile), also record the tracemalloc peak of each stage and function
+    :param cprofile: if True (with profile), also dump the cProfile stats of each stage to data/profiles/{time}/
+    :return: dict mapping the names of the stages that were run to their results
+    """
+    currpath: pathlib.Path = pathlib.Path.cwd()
+
+    # if we're inside the replication_code folder, move up one level
+    if currpath.name == 'replication_code':
+        os.chdir('..')
+        currpath = pathlib.Path.cwd()
+
+    # if '/figures' is not in the current directory, add it
+    if not (currpath / 'figures').exists():
+        (currpath / 'figures').mkdir()
+
+    if not (currpath / 'tables').exists():
+        (currpath / 'tables').mkdir()
+
+    if not (currpath / 'data').exists():
+        (currpath / 'data').mkdir()
 
-    fig.savefig('figures/figure_6_energy_positions.pdf', bbox_inches='tight')
-    fig.savefig('figures/figure_6_energy_positions.png', bbox_inches='tight', dpi=300)
+    pipeline = Pipeline(STAGES, code_files=CODE_FILES)
+    if not profile:
+        return pipeline.run(only, force, jobs)
+
+    profile_dir = f"data/profiles/{datetime.datetime.now():%Y%m%d_%H%M%S}"
+    results = pipeline.run(only, force, jobs, profile={
+        'trace_memory': trace_memory,
+        'cprofile_dir': profile_dir if cprofile else None,
+    })
+    pipeline.write_profile_report(f'{profile_dir}/report')
+    print(f"Profile written to {profile_dir}")
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replicate the tables and figures of the paper")
+    parser.add_argument('--only', nargs='+', metavar='STAGE',
+                        help=f"the stages to produce: {', '.join(stage.name for stage in STAGES)}")
+    parser.add_argument('--force', action='store_true', help="rerun stages even if their results are cached")
+    parser.add_argument('--jobs', type=int, default=1, metavar='N',
+                        help="run up to N independent stages at once, in separate processes")
+    parser.add_argument('--profile', action='store_true',
+                        help="record the time, peak memory and dataframe sizes of each stage to data/profiles")
+    parser.add_argument('--trace-memory', action='store_true', help="with --profile, also trace Python allocations")
+    parser.add_argument('--cprofile', action='store_true', help="with --profile, also dump cProfile stats per stage")
+    args = parser.parse_args()
+    main(args.only, args.force, args.jobs, args.profile, args.trace_memory, args.cprofile)
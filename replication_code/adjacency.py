@@ -0,0 +1,201 @@
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from scipy.sparse.csgraph import connected_components
+
+from config import CLIENT_ID_COL, BILL_ID_COL
+
+
+class SparseAdjacency(NamedTuple):
+    """
+    A signed client x bill adjacency matrix stored as a scipy.sparse CSR matrix, with the client and bill ids of its
+    rows and columns. Neutral positions are kept as explicitly stored zeros, so the sparsity structure of the matrix
+    is the same as the non-NaN entries of the equivalent dense DataFrame.
+    """
+    matrix: sp.csr_matrix
+    clients: pd.Index
+    bills: pd.Index
+
+    @property
+    def shape(self):
+        return self.matrix.shape
+
+    def to_dataframe(self):
+        """
+        Convert to the dense DataFrame returned by get_bipartite_adjacency_matrix, with NaN where no position was
+        recorded
+        :return: pd.DataFrame
+        """
+        coo = self.matrix.tocoo()
+        values = np.full(self.matrix.shape, np.nan)
+        values[coo.row, coo.col] = coo.data
+        return pd.DataFrame(values, index=self.clients, columns=self.bills)
+
+    @classmethod
+    def from_dataframe(cls, dataframe: pd.DataFrame):
+        """
+        Convert a dense adjacency matrix (NaN where no position was recorded) to a SparseAdjacency
+        :param dataframe: the adjacency matrix
+        :return: SparseAdjacency
+        """
+        values = dataframe.values.astype(float)
+        row, col = np.nonzero(~np.isnan(values))
+        matrix = sp.csr_matrix((values[row, col], (row, col)), shape=values.shape)
+        return cls(matrix, pd.Index(dataframe.index), pd.Index(dataframe.columns))
+
+    def split_signs(self):
+        """
+        Split the signed matrix into its positive and negative parts
+        :return: (P, N), two CSR matrices of ones such that matrix = P - N
+        """
+        P = (self.matrix > 0).astype(np.int64).tocsr()
+        N = (self.matrix < 0).astype(np.int64).tocsr()
+        return P, N
+
+
+def _k_core_masks(nonzero: sp.csr_matrix, k_core: tuple):
+    """
+    Find the clients and bills in the (k_core[0], k_core[1]) core of a bipartite graph by peeling off vertices whose
+    degree falls below the threshold. Degrees are updated incrementally from the edges of the removed vertices only.
+    :param nonzero: CSR matrix of ones marking the non-neutral positions
+    :param k_core: the minimum degree of clients and bills
+    :return: boolean masks of the surviving clients and bills
+    """
+    nonzero_csc = nonzero.tocsc()
+    client_degree = np.asarray(nonzero.sum(1)).ravel()
+    bill_degree = np.asarray(nonzero.sum(0)).ravel()
+    client_alive = np.ones(nonzero.shape[0], dtype=bool)
+    bill_alive = np.ones(nonzero.shape[1], dtype=bool)
+
+    while True:
+        dead_bills = np.flatnonzero(bill_alive & (bill_degree < k_core[1]))
+        if len(dead_bills):
+            bill_alive[dead_bills] = False
+            client_degree -= np.asarray(nonzero_csc[:, dead_bills].sum(1)).ravel()
+
+        dead_clients = np.flatnonzero(client_alive & (client_degree < k_core[0]))
+        if len(dead_clients):
+            client_alive[dead_clients] = False
+            bill_degree -= np.asarray(nonzero[dead_clients].sum(0)).ravel()
+
+        if not len(dead_bills) and not len(dead_clients):
+            return client_alive, bill_alive
+
+
+def sparse_bipartite_adjacency_matrix(positions: pd.DataFrame, k_core: tuple = (5, 5), as_dataframe: bool = False):
+    """
+    Sparse equivalent of hbsbm.get_bipartite_adjacency_matrix: construct a signed adjacency matrix from positions
+    data, restrict it to its k-core and then to its largest connected component.
+    :param positions: the positions dataframe
+    :param k_core: the minimum number of clients and bills that must have a position for it to be included in the
+        adjacency matrix. Default is (5, 5).
+    :param as_dataframe: if True, return a dense DataFrame instead of a SparseAdjacency
+    :return: SparseAdjacency (or pd.DataFrame), with clients and bills sorted by id
+    """
+    selection = positions[positions[CLIENT_ID_COL].notnull() & positions[BILL_ID_COL].notnull()]
+
+    n_client_positions = selection[CLIENT_ID_COL].value_counts()
+    n_bill_positions = selection[BILL_ID_COL].value_counts()
+
+    selection = selection[selection[CLIENT_ID_COL].map(n_client_positions) >= k_core[0]]
+    selection = selection[selection[BILL_ID_COL].map(n_bill_positions) >= k_core[1]]
+
+    signs = np.sign(selection.groupby([CLIENT_ID_COL, BILL_ID_COL]).position_numeric.sum())
+
+    del selection
+
+    client_codes, clients = pd.factorize(signs.index.get_level_values(0), sort=True)
+    bill_codes, bills = pd.factorize(signs.index.get_level_values(1), sort=True)
+    values = signs.values.astype(float)
+
+    nonzero = values != 0
+    nonzero_matrix = sp.csr_matrix(
+        (np.ones(nonzero.sum(), dtype=np.int64), (client_codes[nonzero], bill_codes[nonzero])),
+        shape=(len(clients), len(bills)))
+    client_alive, bill_alive = _k_core_masks(nonzero_matrix, k_core)
+
+    # Make sure we still have some data
+    assert client_alive.any() and bill_alive.any(), "No data left after filtering"
+
+    # Re-index the surviving entries (including neutral positions, as in the dense version)
+    keep = client_alive[client_codes] & bill_alive[bill_codes]
+    client_index = np.cumsum(client_alive) - 1
+    bill_index = np.cumsum(bill_alive) - 1
+    rows, cols, values = client_index[client_codes[keep]], bill_index[bill_codes[keep]], values[keep]
+    n_clients, n_bills = client_alive.sum(), bill_alive.sum()
+
+    # Get the largest connected component, with clients numbered before bills
+    graph = sp.csr_matrix((np.ones(len(rows)), (rows, n_clients + cols)), shape=(n_clients + n_bills,) * 2)
+    _, labels = connected_components(graph, directed=False)
+    giant = labels == np.argmax(np.bincount(labels))
+    client_giant, bill_giant = giant[:n_clients], giant[n_clients:]
+
+    keep = client_giant[rows] & bill_giant[cols]
+    client_index = np.cumsum(client_giant) - 1
+    bill_index = np.cumsum(bill_giant) - 1
+    matrix = sp.csr_matrix((values[keep], (client_index[rows[keep]], bill_index[cols[keep]])),
+                           shape=(client_giant.sum(), bill_giant.sum()))
+
+    A = SparseAdjacency(matrix, clients[client_alive][client_giant], bills[bill_alive][bill_giant])
+    if as_dataframe:
+        return A.to_dataframe()
+    return A
+
+
+def projection_matrix(B, congruence, normalization='cossim', columns=None):
+    """
+    One-mode projection of a signed agent x bill matrix onto the agents, as in utils.PositionGraph.agent_projection.
+    With P and N the positive and negative parts of the matrix, agreement counts are P P^T + N N^T and disagreement
+    counts are P N^T + N P^T; each normalization is derived from these.
+    :param B: sparse signed agent x bill matrix; neutral positions (zeros) are ignored
+    :param congruence: 1 for agreement, -1 for disagreement, 'sum' for their sum and 'pos_sum' for the positive part
+        of their sum
+    :param normalization: 'sum', 'cossim', 'jaccard' or 'directed_prop' (see PositionGraph.agent_projection). Degrees
+        and neighborhoods are always counted over all bills in B.
+    :param columns: indices of the bills to count positions on; defaults to all bills
+    :return: sparse CSR matrix of weights with an empty diagonal; W[i, j] is the weight of the edge from agent i to
+        agent j
+    """
+    assert congruence in [1, -1, 'sum', 'pos_sum']
+
+    assert normalization in ['sum', 'cossim', 'jaccard', 'directed_prop']
+
+    B = sp.csr_matrix(B)
+
+    if congruence in ('sum', 'pos_sum'):
+        W = projection_matrix(B, -1, normalization, columns) + projection_matrix(B, 1, normalization, columns)
+        if congruence == 'pos_sum':
+            W = W.multiply(W > 0)
+        W = sp.csr_matrix(W)
+        W.eliminate_zeros()
+        return W
+
+    B_bills = B if columns is None else B[:, columns]
+    P = (B_bills > 0).astype(np.int64)
+    N = (B_bills < 0).astype(np.int64)
+
+    if congruence == 1:
+        W = P @ P.T + N @ N.T
+    else:
+        W = -(P @ N.T + N @ P.T)
+    W = sp.csr_matrix(W, dtype=float)
+    W.setdiag(0)
+    W.eliminate_zeros()
+
+    S = (B != 0).astype(np.int64)
+    degree = np.asarray(S.sum(1), dtype=float).ravel()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if normalization == 'cossim':
+            inv_sqrt = sp.diags(1 / np.sqrt(degree))
+            W = inv_sqrt @ W @ inv_sqrt
+        elif normalization == 'directed_prop':
+            W = sp.diags(1 / degree) @ W
+        elif normalization == 'jaccard':
+            W = W.tocoo()
+            common = np.asarray((S[W.row].multiply(S[W.col])).sum(1)).ravel()
+            union = degree[W.row] + degree[W.col] - common
+            W = sp.csr_matrix((W.data / union, (W.row, W.col)), shape=W.shape)
+
+    return sp.csr_matrix(W)
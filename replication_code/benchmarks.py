@@ -0,0 +1,170 @@
+"""
+Timing benchmarks for the replication code. Run from the outer directory:
+  python replication_code/benchmarks.py             # graph construction on the real positions
+  python replication_code/benchmarks.py --scaling   # all benchmarks on synthetic data from 1k to 10M positions
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+# benchmarks that build dense client x bill matrices or whole graphs in memory, and their default size limits
+DENSE_BENCHMARKS = {'dense_adjacency': 100_000, 'bipartite_graph': 1_000_000, 'agent_projection': 30_000,
+                    'cluster_agreement_plot': 10_000}
+SCALING_SIZES = (1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+
+def _time(func, *args, **kwargs):
+    """
+    Time a single function call
+    :param func: the function
+    :param args: positional arguments passed to func
+    :param kwargs: keyword arguments passed to func
+    :return: (seconds, return value)
+    """
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def benchmark_bipartite_graph(positions: pd.DataFrame, k_core: tuple = (5, 5)):
+    """
+    Time the edge-by-edge and bulk construction of the bipartite graph for every state/record_type pair, and check
+    that both produce identical graphs.
+    :param positions: the positions dataframe
+    :param k_core: passed to get_bipartite_adjacency_matrix
+    :return: a dataframe of timings, indexed by state and record type
+    """
+    # imported here because this requires graph-tool
+    from hbsbm import get_bipartite_adjacency_matrix, get_bipartite_graph, graphs_identical
+
+    results = []
+    for state, record_type in positions[['state', 'record_type']].value_counts().index.values:
+        print(f"Benchmarking {state} {record_type}")
+        selected_positions = positions[(positions.state == state) & (positions.record_type == record_type)]
+        adj_matrix = get_bipartite_adjacency_matrix(selected_positions, k_core=k_core)
+
+        loop_time, g_loop = _time(get_bipartite_graph, adj_matrix, bulk=False)
+        bulk_time, g_bulk = _time(get_bipartite_graph, adj_matrix, bulk=True)
+
+        results.append({
+            'state': state,
+            'record_type': record_type,
+            'vertices': g_bulk.num_vertices(),
+            'edges': g_bulk.num_edges(),
+            'loop_seconds': loop_time,
+            'bulk_seconds': bulk_time,
+            'speedup': loop_time / bulk_time,
+            'identical': graphs_identical(g_loop, g_bulk),
+        })
+
+    return pd.DataFrame(results).set_index(['state', 'record_type'])
+
+
+def _scaling_benchmarks(positions, blocks):
+    """
+    The benchmarks of benchmark_scaling on one synthetic positions table
+    :return: generator of (name, function to time, dict describing the input), in order; each function returns the
+        input of the following ones where needed
+    """
+    from adjacency import sparse_bipartite_adjacency_matrix
+    from utils import PositionGraph, cluster_agreement_plot
+
+    A = sparse_bipartite_adjacency_matrix(positions)
+    size = {'clients': len(A.clients), 'bills': len(A.bills), 'edges': A.matrix.nnz}
+    yield 'sparse_adjacency', lambda: sparse_bipartite_adjacency_matrix(positions), size
+
+    try:
+        from hbsbm import get_bipartite_adjacency_matrix, get_bipartite_graph
+    except ImportError:
+        # graph-tool is not installed
+        get_bipartite_adjacency_matrix = get_bipartite_graph = None
+
+    if get_bipartite_adjacency_matrix is not None:
+        yield 'dense_adjacency', lambda: get_bipartite_adjacency_matrix(positions), size
+        # from the sparse matrix, as a dense one would not fit in memory at the larger sizes
+        yield 'bipartite_graph', lambda: get_bipartite_graph(A), size
+
+    def agent_projection():
+        pos_graph = PositionGraph()
+        pos_graph.add_positions_from_dataframe(A.to_dataframe())
+        return pos_graph.agent_projection('pos_sum', 'cossim')
+
+    yield 'agent_projection', agent_projection, size
+
+    def plot():
+        import matplotlib
+        matplotlib.use('Agg')
+        from matplotlib import pyplot as plt
+
+        B = A.to_dataframe()
+        c_dict = {client: blocks[client] for client in B.index}
+        fig, ax = plt.subplots(1, 1, figsize=(10, 10))
+        # without the layout cache, so that every repeat computes the layout
+        cluster_agreement_plot(B, c_dict, relation='both', ax=ax, layout_cache_dir=None)
+        plt.close(fig)
+
+    yield 'cluster_agreement_plot', plot, size
+
+
+def benchmark_scaling(sizes=SCALING_SIZES, benchmarks=None, repeats: int = 1, max_dense_positions=None,
+                      seed: int = 0, **synthetic_kwargs):
+    """
+    Time the graph construction, projection and plotting code on synthetic positions (see synthetic.py) of
+    increasing size. The positions of each size are all in one state and record type, so that each benchmark runs on
+    a single slice as large as the whole table.
+    :param sizes: the numbers of positions
+    :param benchmarks: the names of the benchmarks to run; defaults to all. These are 'sparse_adjacency',
+        'dense_adjacency', 'bipartite_graph', 'agent_projection' and 'cluster_agreement_plot'; the dense adjacency
+        matrix and bipartite graph require graph-tool and are skipped without it.
+    :param repeats: the number of times to run each benchmark; the fastest run is reported
+    :param max_dense_positions: dict overriding DENSE_BENCHMARKS, the largest sizes at which to run the benchmarks
+        that hold dense matrices or whole graphs in memory
+    :param seed: the seed of the synthetic data
+    :param synthetic_kwargs: passed to synthetic.synthetic_positions
+    :return: a dataframe of timings, indexed by size and benchmark
+    """
+    from synthetic import synthetic_positions
+
+    limits = {**DENSE_BENCHMARKS, **(max_dense_positions or {})}
+    synthetic_kwargs = {'states': ('WI',), 'record_types': ('lobbying',), **synthetic_kwargs}
+
+    results = []
+    for n_positions in sizes:
+        print(f"Generating {n_positions} positions")
+        generation_time, (positions, blocks) = _time(
+            synthetic_positions, n_positions, seed=seed, return_blocks=True, **synthetic_kwargs)
+
+        for name, func, size in _scaling_benchmarks(positions, blocks):
+            if (benchmarks is not None and name not in benchmarks) or n_positions > limits.get(name, np.inf):
+                continue
+            print(f"Benchmarking {name} on {n_positions} positions")
+            seconds = min(_time(func)[0] for _ in range(repeats))
+            results.append({'positions': n_positions, 'benchmark': name, **size, 'seconds': seconds,
+                            'generation_seconds': generation_time})
+
+    return pd.DataFrame(results).set_index(['positions', 'benchmark'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scaling', action='store_true',
+                        help='benchmark on synthetic data of increasing size instead of the real positions')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SCALING_SIZES,
+                        help='the numbers of synthetic positions (with --scaling)')
+    parser.add_argument('--benchmarks', nargs='+', help='the benchmarks to run (with --scaling); defaults to all')
+    parser.add_argument('--repeats', type=int, default=1, help='the number of runs of each benchmark (with --scaling)')
+    parser.add_argument('--output', help='also write the results to this CSV file')
+    args = parser.parse_args()
+
+    if args.scaling:
+        results = benchmark_scaling(args.sizes, args.benchmarks, args.repeats)
+    else:
+        import load
+
+        results = benchmark_bipartite_graph(load.positions())
+
+    print(results.to_string())
+    if args.output:
+        results.to_csv(args.output)
@@ -0,0 +1,133 @@
+# Compact, pickle-free export of the blockstates. Each blockstate is written to a directory of .npy files which can be
+# memory-mapped and read without graph-tool:
+#   meta.json       state, record type, number of vertices, edges and levels
+#   names.npy       vertex names (client and bill ids), as a fixed-width unicode array
+#   kinds.npy       vertex kinds: clients - 0, bills - 1
+#   edges.npy       (E, 3) array of source vertex, target vertex and edge weight (the numeric position)
+#   partitions.npy  (L, V) array; row l is the block of each vertex at level l, i.e. project_partition(l, 0)
+#   bs.npy          the per-level partitions of the hierarchy (blockstate.get_bs()), concatenated
+#   bs_offsets.npy  the offsets of each level in bs.npy
+import json
+import pathlib
+
+import numpy as np
+import pandas as pd
+
+
+def compact_blockstate_path(state, record_type):
+    return f"data/hbsbm/compact/{state}_{record_type}_corrected_categorical_blockstate"
+
+
+def export_blockstate(blockstate, directory, state=None, record_type=None):
+    """
+    Write a graph-tool NestedBlockState to the compact format
+    :param blockstate: the blockstate
+    :param directory: the directory to write to; it is created if it does not exist
+    :param state: the US state, stored in the metadata
+    :param record_type: the record type, stored in the metadata
+    :return: the directory
+    """
+    directory = pathlib.Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    g = blockstate.g
+    n_levels = len(blockstate.levels)
+    bs = [np.asarray(b, dtype=np.int32) for b in blockstate.get_bs()[:n_levels]]
+
+    np.save(directory / 'names.npy', np.array(list(g.vp.name), dtype=str))
+    np.save(directory / 'kinds.npy', g.vp.kind.a.astype(np.int8))
+    np.save(directory / 'edges.npy', g.get_edges([g.ep.weight]).astype(np.int32))
+    np.save(directory / 'partitions.npy', np.stack([
+        np.asarray(blockstate.project_partition(level, 0).a, dtype=np.int32) for level in range(n_levels)
+    ]))
+    np.save(directory / 'bs.npy', np.concatenate(bs))
+    np.save(directory / 'bs_offsets.npy', np.cumsum([0, *map(len, bs)]))
+
+    with open(directory / 'meta.json', 'w') as f:
+        json.dump({
+            'state': state,
+            'record_type': record_type,
+            'n_vertices': g.num_vertices(),
+            'n_edges': g.num_edges(),
+            'n_levels': n_levels,
+        }, f)
+
+    return directory
+
+
+def export_all_blockstates(blockstates):
+    """
+    Write every blockstate to the compact format, at compact_blockstate_path
+    :param blockstates: a mapping from (state, record_type) to blockstates, as returned by load.blockstates
+    :return:
+    """
+    for state, record_type in blockstates.keys():
+        print(f"Exporting {state} {record_type}")
+        export_blockstate(blockstates[(state, record_type)], compact_blockstate_path(state, record_type),
+                          state, record_type)
+
+
+class CompactBlockstate:
+    """
+    Read-only view of a blockstate written by export_blockstate. Arrays are memory-mapped, so opening a blockstate
+    is cheap and only the parts that are used are read from disk.
+    """
+
+    def __init__(self, directory, mmap_mode='r'):
+        self.directory = pathlib.Path(directory)
+        with open(self.directory / 'meta.json') as f:
+            self.meta = json.load(f)
+
+        def _load(name):
+            return np.load(self.directory / f'{name}.npy', mmap_mode=mmap_mode)
+
+        self.names = _load('names')
+        self.kinds = _load('kinds')
+        self.edges = _load('edges')
+        self.partitions = _load('partitions')
+        self._bs = _load('bs')
+        self._bs_offsets = _load('bs_offsets')
+
+    @property
+    def n_levels(self):
+        return self.meta['n_levels']
+
+    def get_bs(self):
+        """
+        The partitions of each level of the hierarchy, as in NestedBlockState.get_bs()
+        :return: list of arrays
+        """
+        return [self._bs[self._bs_offsets[l]:self._bs_offsets[l + 1]] for l in range(self.n_levels)]
+
+    def project_partition(self, j, l):
+        """
+        Project the partition of level j onto level l, as in NestedBlockState.project_partition
+        :param j: the level of the partition
+        :param l: the level to project onto; 0 gives the block of each vertex
+        :return: array of the level-j block of each node at level l
+        """
+        if l == 0:
+            return self.partitions[j]
+        bs = self.get_bs()
+        blocks = np.arange(len(bs[l]))
+        for level in range(l, j + 1):
+            blocks = bs[level][blocks]
+        return blocks
+
+    def block_assignments(self):
+        """
+        The block of every vertex at every level, indexed by vertex name
+        :return: pd.DataFrame with one column per level
+        """
+        return pd.DataFrame(np.asarray(self.partitions).T, index=pd.Index(self.names))
+
+
+def read_blockstate(state, record_type, mmap_mode='r'):
+    """
+    Open the compact export of a blockstate
+    :param state: the US state
+    :param record_type: the record type
+    :param mmap_mode: passed to np.load; None reads the arrays into RAM
+    :return: CompactBlockstate
+    """
+    return CompactBlockstate(compact_blockstate_path(state, record_type), mmap_mode=mmap_mode)
@@ -0,0 +1,77 @@
+# Record counts behind figures 1 and 2, accumulated incrementally over batches of positions (see load.iter_positions)
+import pandas as pd
+
+from config import CLIENT_ID_COL, BILL_ID_COL
+
+COUNT_COLUMNS = [CLIENT_ID_COL, BILL_ID_COL, 'record_type', 'year', 'position_numeric']
+
+
+def _add(total, counts):
+    if total is None:
+        return counts
+    return total.add(counts, fill_value=0).astype(total.dtype)
+
+
+class RecordCounts:
+    """
+    Running counts of the records per year, per bill and per client of each record type. Memory use depends on the
+    number of distinct bills and clients, not on the number of positions.
+    """
+
+    def __init__(self, last_year=2022):
+        """
+        :param last_year: records from this year onwards are left out of the counts per year
+        """
+        self.last_year = last_year
+        self._per_year = None
+        self._per_bill = None
+        self._per_client = None
+
+    def update(self, positions: pd.DataFrame):
+        """
+        Add a batch of positions to the counts
+        :param positions: a dataframe with (at least) the columns in COUNT_COLUMNS
+        :return: self
+        """
+        dated = positions[positions[CLIENT_ID_COL].notna() & (positions.year < self.last_year)]
+        self._per_year = _add(self._per_year, dated.groupby(['record_type', 'year']).position_numeric.count())
+        self._per_bill = _add(self._per_bill, positions[[BILL_ID_COL, 'record_type']].value_counts())
+        self._per_client = _add(self._per_client, positions[[CLIENT_ID_COL, 'record_type']].value_counts())
+        return self
+
+    @classmethod
+    def from_batches(cls, batches, last_year=2022):
+        """
+        Accumulate the counts over batches of positions
+        :param batches: an iterable of dataframes, or of (key, dataframe) pairs as yielded by load.iter_positions
+        :param last_year: see __init__
+        :return: RecordCounts
+        """
+        counts = cls(last_year)
+        for batch in batches:
+            counts.update(batch[1] if isinstance(batch, tuple) else batch)
+        return counts
+
+    @property
+    def records_per_year(self):
+        """
+        The number of positions of each record type per year, for figure 1
+        :return: pd.DataFrame indexed by year, with one column per record type
+        """
+        return self._per_year.unstack().T
+
+    @property
+    def records_per_bill(self):
+        """
+        The number of records on each bill, for figure 2
+        :return: pd.DataFrame indexed by bill id, with one column per record type
+        """
+        return self._per_bill.unstack()
+
+    @property
+    def records_per_client(self):
+        """
+        The number of records of each client, for figure 2
+        :return: pd.DataFrame indexed by client id, with one column per record type
+        """
+        return self._per_client.unstack()
@@ -0,0 +1,112 @@
+# Words predictive of bill block membership (Table 3), from a Naive Bayes classifier fitted on TF-IDF bill titles
+import functools
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy.special import logsumexp
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.naive_bayes import MultinomialNB
+
+import load
+
+
+class BlockDescriptors:
+    """
+    Word loadings of the bill blocks at every level of a blockmodel. The TF-IDF document-term matrix of the bill
+    titles is fitted once and shared by all levels.
+
+    The loading of a word on a block is the probability the classifier gives to the block for a document made of that
+    word alone, normalized to sum to one over the words of each block. A single-word TF-IDF document is the unit
+    vector of that word, so these probabilities are the softmax of feature_log_prob_ + class_log_prior_ over the
+    blocks, and no document has to be transformed.
+    """
+
+    def __init__(self, bill_table: pd.DataFrame, text_column='title', prefix='block_level_', alpha=1.0):
+        """
+        :param bill_table: the bills dataframe, with a {prefix}{level} column for each block level (see
+            load.bills_with_blocks)
+        :param text_column: the column of bill_table holding the text to describe blocks with
+        :param prefix: the prefix of the block level columns
+        :param alpha: the smoothing parameter of MultinomialNB
+        """
+        self.level_columns = {
+            int(column[len(prefix):]): column
+            for column in bill_table.columns if column.startswith(prefix) and column[len(prefix):].isnumeric()
+        }
+        # bills outside the blockmodel have no block at any level
+        self.bills = bill_table[bill_table[list(self.level_columns.values())].notna().any(axis=1)]
+        self.alpha = alpha
+
+        self.tfidf = TfidfVectorizer()
+        self.X = self.tfidf.fit_transform(self.bills[text_column].fillna(''))
+        self.vocabulary = self.tfidf.get_feature_names_out()
+        self._loadings = {}
+
+    @property
+    def levels(self):
+        return sorted(self.level_columns)
+
+    def word_loadings(self, level):
+        """
+        The loading of every word on every block of a level
+        :param level: the block level
+        :return: pd.DataFrame with one row per block and one column per word
+        """
+        if level not in self._loadings:
+            y = self.bills[self.level_columns[level]]
+            mask = y.notna().values
+            nb = MultinomialNB(alpha=self.alpha).fit(self.X[mask], y[mask])
+
+            # joint log likelihood of each single-word document and each block
+            jll = nb.feature_log_prob_.T + nb.class_log_prior_
+            proba = np.exp(jll - logsumexp(jll, axis=1, keepdims=True))
+
+            self._loadings[level] = pd.DataFrame((proba / proba.sum(0)).T, index=nb.classes_,
+                                                 columns=self.vocabulary)
+        return self._loadings[level]
+
+    def all_word_loadings(self):
+        """
+        :return: dict mapping each level to its word loadings
+        """
+        return {level: self.word_loadings(level) for level in self.levels}
+
+    def top_words(self, level, n=5):
+        """
+        The n words with the highest loadings on each block of a level, as in Table 3
+        :return: pd.Series of comma-separated words, indexed by block
+        """
+        return self.word_loadings(level).apply(lambda r: ', '.join(r.nlargest(n).index.values), 1)
+
+
+@functools.lru_cache(maxsize=32)
+def block_descriptors(state, record_type='lobbying'):
+    """
+    The BlockDescriptors of a blockmodel, fitted once per process and state
+    :param state: the US state
+    :param record_type: the record type of the blockmodel
+    :return: BlockDescriptors
+    """
+    return BlockDescriptors(load.bills_with_blocks(state, record_type))
+
+
+def _all_word_loadings(key):
+    return block_descriptors(*key).all_word_loadings()
+
+
+def all_block_word_loadings(keys=None, n_workers=1):
+    """
+    Word loadings of every level of several blockmodels
+    :param keys: (state, record_type) pairs; defaults to all blockmodels
+    :param n_workers: the number of processes to use; 1 runs in this process and keeps the fitted descriptors in its
+        cache
+    :return: dict mapping (state, record_type) to a dict mapping each level to its word loadings
+    """
+    keys = list(load.BLOCKSTATE_KEYS if keys is None else keys)
+
+    if n_workers == 1:
+        return {key: _all_word_loadings(key) for key in keys}
+
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        return dict(zip(keys, executor.map(_all_word_loadings, keys)))
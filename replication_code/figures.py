@@ -3,6 +3,7 @@ import pandas as pd
 from matplotlib import pyplot as plt
 
 from config import CLIENT_ID_COL, BILL_ID_COL
+from profiling import profiled
 import utils
 
 import importlib
@@ -10,6 +11,7 @@ importlib.reload(utils)
 
 
 
+@profiled
 def figure_1_records_per_year(records_per_year):
     """
     Plot the records per year line plots in figure 1
@@ -32,6 +34,7 @@ def figure_1_records_per_year(records_per_year):
     return fig
 
 
+@profiled
 def figure_2_histogram(records_per_bill_hist: pd.Series, records_per_client_hist: pd.Series):
     """
     Plot the histograms in figure 2
@@ -61,6 +64,7 @@ def figure_2_histogram(records_per_bill_hist: pd.Series, records_per_client_hist
     return fig
 
 
+@profiled
 def figure_3_blockmodel(wi_blockstate, filename="figure_3_blockmodel_spaghetti.png"):
     """
     Plot the blockmodel for Wisconsin using the "spaghetti" plot
@@ -73,6 +77,7 @@ def figure_3_blockmodel(wi_blockstate, filename="figure_3_blockmodel_spaghetti.p
     plot_bipartite(wi_blockstate, f"figures/{filename}", nedges=5000)
 
 
+@profiled
 def figure_4_blockmodel_projection(wi_positions, wi_block_levels, wi_clients, block_level=3):
     """
     Plot the blockmodel projection for Wisconsin at a given block level
@@ -101,6 +106,7 @@ def figure_4_blockmodel_projection(wi_positions, wi_block_levels, wi_clients, bl
     return fig
 
 
+@profiled
 def figure_5_nmi_a(known_nmi, known_ftm_sample, guessed_nmi, guessed_sample):
     """
     Plot the NMI between block-level assignments and FTM classification
@@ -132,6 +138,7 @@ def figure_5_nmi_a(known_nmi, known_ftm_sample, guessed_nmi, guessed_sample):
     return fig, ax
 
 
+@profiled
 def figure_5_nmi_b(topic_nmi, wi_bills_with_topics, meta_topic_nmi, wi_bills_sample):
     """
     Plot the NMI between block-level assignments and NCSL topic category
@@ -163,6 +170,7 @@ def figure_5_nmi_b(topic_nmi, wi_bills_with_topics, meta_topic_nmi, wi_bills_sam
     return fig
 
 
+@profiled
 def figure_6_energy_positions(state_adj_matrices, state_block_names, states):
     """
     Plot the projection of client positions on energy bills for each state
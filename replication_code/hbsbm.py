@@ -1,7 +1,14 @@
+import contextlib
 import datetime
 import json
+import multiprocessing
+import os
+import pathlib
 import pickle
+import time
+import zlib
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import graph_tool.all as gt
 import networkx as nx
@@ -9,21 +16,50 @@ import numpy as np
 import pandas as pd
 import tqdm
 
+from adjacency import SparseAdjacency, sparse_bipartite_adjacency_matrix
 from config import CLIENT_ID_COL, BILL_ID_COL
+from profiling import profiled
+from warm_start import warm_start_partition
 
 
-def get_bipartite_graph(bipartite_adj_matrix: pd.DataFrame):
+def get_bipartite_edgelist(bipartite_adj_matrix):
     """
-    Construct a bipartite graph representing positions data from an adjacency matrix
-    This replication_code is adapted from the sbmtm model replication_code: https://github.com/martingerlach/hSBM_Topicmodel
-    :param bipartite_adj_matrix: the adjacency matrix
-    :return: a bipartite graph-tool graph
+    Construct the signed client-bill edgelist of an adjacency matrix
+    :param bipartite_adj_matrix: the adjacency matrix, as a pd.DataFrame or SparseAdjacency
+    :return: a dataframe with columns 'source', 'target' and 'weight'
     """
+    if isinstance(bipartite_adj_matrix, SparseAdjacency):
+        coo = bipartite_adj_matrix.matrix.tocoo()
+        E_combo = pd.DataFrame({
+            'source': bipartite_adj_matrix.clients[coo.row],
+            'target': bipartite_adj_matrix.bills[coo.col],
+            'weight': coo.data,
+        })
+        return E_combo[E_combo.weight.isin([1, -1])]
+
     # Construct edgelist; for now, keep only positive and negative positions
     E_combo = bipartite_adj_matrix[~bipartite_adj_matrix.isna()].stack()
     E_combo = E_combo.reset_index(drop=False)
     E_combo.columns = ['source', 'target', 'weight']
     E_combo = E_combo[E_combo.weight.isin([1, -1])]
+    return E_combo
+
+
+@profiled
+def get_bipartite_graph(bipartite_adj_matrix, bulk: bool = True):
+    """
+    Construct a bipartite graph representing positions data from an adjacency matrix
+    This replication_code is adapted from the sbmtm model replication_code: https://github.com/martingerlach/hSBM_Topicmodel
+    :param bipartite_adj_matrix: the adjacency matrix, as a pd.DataFrame or SparseAdjacency
+    :param bulk: if True, factorize the client and bill ids once and add all vertices and edges in a single
+        array-based call. If False, add the edges one at a time (the original, much slower, implementation).
+        Both produce identical graphs.
+    :return: a bipartite graph-tool graph
+    """
+    E_combo = get_bipartite_edgelist(bipartite_adj_matrix)
+
+    if bulk:
+        return _get_bipartite_graph_bulk(E_combo)
 
     g = gt.Graph(directed=False)
 
@@ -65,6 +101,49 @@ def get_bipartite_graph(bipartite_adj_matrix: pd.DataFrame):
     return g
 
 
+def _get_bipartite_graph_bulk(E_combo: pd.DataFrame):
+    """
+    Array-based construction of the bipartite graph from an edgelist (see get_bipartite_graph)
+    :param E_combo: the edgelist, as returned by get_bipartite_edgelist
+    :return: a bipartite graph-tool graph
+    """
+    # pd.factorize numbers the ids in order of first appearance, which is the same order as .unique(),
+    # so the vertex indices match those of the edge-by-edge construction
+    client_codes, igs = pd.factorize(E_combo.source)
+    bill_codes, bls = pd.factorize(E_combo.target)
+    I = len(igs)
+
+    g = gt.Graph(directed=False)
+    g.add_vertex(I + len(bls))
+
+    # clients first, then bills
+    g.vp["name"] = g.new_vp("string", vals=[*igs, *bls])
+    kind = g.vp["kind"] = g.new_vp("int")
+    kind.a[I:] = 1
+    etype = g.ep["weight"] = g.new_ep("int")
+
+    edges = np.column_stack([client_codes, I + bill_codes, E_combo.weight.values]).astype(np.int64)
+    g.add_edge_list(edges, eprops=[etype])
+
+    return g
+
+
+def graphs_identical(g1, g2):
+    """
+    Check whether two bipartite graphs have the same vertices, vertex properties, edges and edge weights
+    :param g1: a graph-tool graph, as returned by get_bipartite_graph
+    :param g2: a graph-tool graph, as returned by get_bipartite_graph
+    :return: bool
+    """
+    if (g1.num_vertices() != g2.num_vertices()) or (g1.num_edges() != g2.num_edges()):
+        return False
+    if list(g1.vp.name) != list(g2.vp.name):
+        return False
+    if not np.array_equal(g1.vp.kind.a, g2.vp.kind.a):
+        return False
+    return np.array_equal(g1.get_edges([g1.ep.weight]), g2.get_edges([g2.ep.weight]))
+
+
 def remove_redundant_levels(state: gt.BlockState):
     """
     Remove redundant levels from a blockstate
@@ -91,14 +170,19 @@ def remove_redundant_levels(state: gt.BlockState):
     return state
 
 
-def get_bipartite_adjacency_matrix(positions: pd.DataFrame, k_core: tuple = (5, 5)):
+@profiled
+def get_bipartite_adjacency_matrix(positions: pd.DataFrame, k_core: tuple = (5, 5), sparse: bool = False):
     """
     Construct an adjacency matrix from positions data
     :param positions: the positions dataframe
     :param k_core: the minimum number of clients and bills that must have a position for it to be included in the
         adjacency matrix. Default is (5, 5).
+    :param sparse: if True, build the matrix, k-core and giant component with scipy.sparse and return a
+        SparseAdjacency (see adjacency.sparse_bipartite_adjacency_matrix) instead of a dense DataFrame
     :return: the adjacency matrix
     """
+    if sparse:
+        return sparse_bipartite_adjacency_matrix(positions, k_core)
 
     selection = positions[positions[CLIENT_ID_COL].notnull()].copy()
     selection = selection[selection[BILL_ID_COL].notnull()]
@@ -132,7 +216,24 @@ def get_bipartite_adjacency_matrix(positions: pd.DataFrame, k_core: tuple = (5,
     return A
 
 
-def save_blockmodel_and_metadata(blockstate, region, record_type, deg_corr, layers, overlap, pmode=None, **kwargs):
+def blockmodel_path(region, record_type, deg_corr, layers, directory="data/hbsbm"):
+    """
+    Deterministic path (without extension) of a saved blockmodel, following the naming of the published blockstates,
+    e.g. data/hbsbm/WI_lobbying_corrected_categorical_blockstate
+    :param region: the region (US state)
+    :param record_type: the record type
+    :param deg_corr: the degree correction parameter
+    :param layers: whether the blockmodel has layers
+    :param directory: the directory the blockmodel is saved in
+    :return: str
+    """
+    correction = 'corrected' if deg_corr else 'uncorrected'
+    model = 'layered' if layers else 'categorical'
+    return f"{directory}/{region}_{record_type}_{correction}_{model}_blockstate"
+
+
+def save_blockmodel_and_metadata(blockstate, region, record_type, deg_corr, layers, overlap, pmode=None,
+                                 path=None, **kwargs):
     """
     Save a blockmodel and its metadata
     :param blockstate: the blockstate
@@ -142,11 +243,13 @@ def save_blockmodel_and_metadata(blockstate, region, record_type, deg_corr, laye
     :param layers: whether the blockmodel has layers
     :param overlap: the overlap parameter
     :param pmode: the PartitionModeState object
+    :param path: where to save the blockmodel, without extension. If None, a timestamped path in data/hbsbm is used.
     :param kwargs: any additional metadata
-    :return:
+    :return: the path the blockmodel was saved to
     """
-    date_time = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    blockmodel_path = f"data/hbsbm/{date_time}"
+    if path is None:
+        date_time = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        path = f"data/hbsbm/{date_time}"
 
     metadata = {
         'region': region,
@@ -157,17 +260,20 @@ def save_blockmodel_and_metadata(blockstate, region, record_type, deg_corr, laye
         **kwargs
     }
 
-    with open(blockmodel_path + '.pkl', 'wb') as f:
+    with open(path + '.pkl', 'wb') as f:
         pickle.dump(blockstate, f)
 
-    with open(blockmodel_path + '_metadata.json', 'w') as f:
+    with open(path + '_metadata.json', 'w') as f:
         json.dump(metadata, f)
 
     if pmode is not None:
-        with open(blockmodel_path + '_pmode.pkl', 'wb') as f:
+        with open(path + '_pmode.pkl', 'wb') as f:
             pickle.dump(pmode, f)
 
+    return path
 
+
+@profiled
 def estimate_blockmodel(graph, deg_corr: bool, layers: bool, overlap: bool):
     """
     Run a blockmodel on a graph-tool graph with the given parameters
@@ -178,28 +284,76 @@ def estimate_blockmodel(graph, deg_corr: bool, layers: bool, overlap: bool):
     :return:
     """
 
-    if not overlap:
-        clabel = graph.vp['kind']
-    else:
-        clabel = None
-
     print("Estimating blockstate")
     blockstate = gt.minimize_nested_blockmodel_dl(
         graph,
-        state_args=dict(
-            base_type=gt.LayeredBlockState,
-            clabel=clabel, pclabel=clabel,  # impose hard bipartite constraint
-            state_args=dict(ec=graph.ep.weight,
-                            layers=layers,
-                            deg_corr=deg_corr,
-                            overlap=overlap,
-                            )),
+        state_args=_nested_state_args(graph, deg_corr, layers, overlap),
         multilevel_mcmc_args=dict(verbose=True)
     )
 
     return blockstate
 
 
+def _nested_state_args(graph, deg_corr: bool, layers: bool, overlap: bool):
+    """
+    The arguments of the nested blockstates of a graph, shared by estimate_blockmodel and warm_start_blockstate
+    """
+    if not overlap:
+        clabel = graph.vp['kind']
+    else:
+        clabel = None
+
+    return dict(
+        base_type=gt.LayeredBlockState,
+        clabel=clabel, pclabel=clabel,  # impose hard bipartite constraint
+        state_args=dict(ec=graph.ep.weight,
+                        layers=layers,
+                        deg_corr=deg_corr,
+                        overlap=overlap,
+                        ))
+
+
+@profiled
+def warm_start_blockstate(graph, old_blockstate, deg_corr: bool, layers: bool, state: str = None):
+    """
+    A nested blockstate of a graph initialized from the partition of a previous fit (see warm_start_partition)
+    :param graph: the new graph, as returned by get_bipartite_graph
+    :param old_blockstate: the nested blockstate of the previous fit
+    :param deg_corr: the degree correction parameter
+    :param layers: whether the blockmodel has layers
+    :param state: the US state, whose prefix is ignored when matching the vertex names of the two graphs
+    :return: (blockstate, number of new vertices)
+    """
+    bs, n_new = warm_start_partition(
+        list(old_blockstate.g.vp.name), old_blockstate.g.vp.kind.a, old_blockstate.get_bs(),
+        list(graph.vp.name), graph.vp.kind.a, graph.get_edges([graph.ep.weight]), state=state)
+    print(f"Warm start: {n_new} of {graph.num_vertices()} vertices are new")
+    return gt.NestedBlockState(graph, bs=bs, **_nested_state_args(graph, deg_corr, layers, False)), n_new
+
+
+@profiled
+def refine_warm_start(blockstate, max_sweeps: int = 100, tol: float = 1e-3):
+    """
+    Greedy merge-split MCMC sweeps from a warm-started blockstate, until a sweep no longer lowers the description
+    length by more than tol (relative), then remove redundant levels. Starting close to the optimum, this needs far
+    fewer sweeps than a fit from scratch.
+    :param blockstate: the nested blockstate
+    :param max_sweeps: the maximum number of sweeps
+    :param tol: the relative change in description length below which the refinement stops
+    :return: the refined blockstate
+    """
+    print("Refining warm-started blockstate...")
+    for _ in tqdm.tqdm(range(max_sweeps)):
+        entropy = blockstate.entropy()
+        dS, _, _ = blockstate.multiflip_mcmc_sweep(beta=np.inf, niter=10)
+        if abs(dS) <= tol * abs(entropy):
+            break
+    print("Done.")
+
+    return remove_redundant_levels(blockstate)
+
+
+@profiled
 def refine_blockmodel(blockstate, overlap):
     """
     Refine a blockmodel by annealing and removing redundant levels
@@ -225,10 +379,11 @@ def refine_blockmodel(blockstate, overlap):
     return remove_redundant_levels(blockstate)
 
 
-def get_partition_mode_state(blockstate):
+def get_partition_mode_state(blockstate, force_niter: int = 1000):
     """
     Get the partition mode blockstate from a blockstate object
     :param blockstate:
+    :param force_niter: the number of equilibration sweeps to collect partitions from
     :return:
     """
     bs = []  # partitions
@@ -239,7 +394,7 @@ def get_partition_mode_state(blockstate):
     # Now we collect 2000 partitions; but the larger this is, the
     # more accurate will be the calculation
     print("Collecting partition modes...")
-    gt.mcmc_equilibrate(blockstate, force_niter=1000, mcmc_args=dict(niter=10),
+    gt.mcmc_equilibrate(blockstate, force_niter=force_niter, mcmc_args=dict(niter=10),
                         callback=collect_partitions)
     # Infer partition modes
     pmode = gt.ModeClusterState(bs, nested=True)
@@ -247,6 +402,7 @@ def get_partition_mode_state(blockstate):
     return pmode
 
 
+@profiled
 def run_blockmodel_from_scratch(positions: pd.DataFrame, state: str, record_type: str, deg_corr: bool, layers: bool,
                                 overlap: bool = False):
     """
@@ -261,12 +417,96 @@ def run_blockmodel_from_scratch(positions: pd.DataFrame, state: str, record_type
     """
     selected_positions = positions[(positions.state == state) & (positions.record_type == record_type)]
     adj_matrix = get_bipartite_adjacency_matrix(selected_positions, k_core=(5, 5))
+    blockstate, pmode = fit_blockmodel(adj_matrix, deg_corr, layers, overlap)
+
+    save_blockmodel_and_metadata(blockstate, state, record_type, deg_corr, layers, overlap, pmode=pmode)
+
+
+@profiled
+def fit_blockmodel(adj_matrix, deg_corr: bool, layers: bool, overlap: bool = False):
+    """
+    Estimate, refine and collect the partition modes of a blockmodel for an adjacency matrix
+    :param adj_matrix: the adjacency matrix, as a pd.DataFrame or SparseAdjacency
+    :param deg_corr: whether to use degree correction
+    :param layers: whether to use layers or categorical labels
+    :param overlap: whether to allow overlappping blocks
+    :return: (blockstate, pmode)
+    """
     graph = get_bipartite_graph(adj_matrix)
     blockstate = estimate_blockmodel(graph, deg_corr, layers, overlap)
     blockstate = refine_blockmodel(blockstate, overlap)
     pmode = get_partition_mode_state(blockstate)
+    return blockstate, pmode
 
-    save_blockmodel_and_metadata(blockstate, state, record_type, deg_corr, layers, overlap, pmode=pmode)
+
+@profiled
+def fit_blockmodel_incremental(adj_matrix, old_blockstate, deg_corr: bool, layers: bool, max_sweeps: int = 100,
+                               pmode_niter: int = 100, state: str = None, min_matched: float = 0.5):
+    """
+    Refit a blockmodel to an adjacency matrix that extends (e.g. with a new legislative session) the one of a
+    previous fit, starting from the previous partition instead of from scratch. Overlapping blockmodels are not
+    supported.
+    :param adj_matrix: the adjacency matrix, as a pd.DataFrame or SparseAdjacency
+    :param old_blockstate: the nested blockstate of the previous fit
+    :param deg_corr: whether to use degree correction
+    :param layers: whether to use layers or categorical labels
+    :param max_sweeps: see refine_warm_start
+    :param pmode_niter: the number of sweeps to collect the partition modes from (see get_partition_mode_state)
+    :param state: the US state, see warm_start_blockstate
+    :param min_matched: the smallest fraction of the vertices that must be in the previous fit; below it, the previous
+        partition says little about the new graph (or the names do not match), and the blockmodel is fitted from
+        scratch instead
+    :return: (blockstate, pmode, dict with the number of new vertices and whether the fit was warm-started)
+    """
+    graph = get_bipartite_graph(adj_matrix)
+    blockstate, n_new = warm_start_blockstate(graph, old_blockstate, deg_corr, layers, state)
+    matched = 1 - n_new / max(graph.num_vertices(), 1)
+    if matched < min_matched:
+        print(f"Warning: only {matched:.0%} of the vertices are in the previous blockmodel; fitting from scratch")
+        blockstate = refine_blockmodel(estimate_blockmodel(graph, deg_corr, layers, False), False)
+        return blockstate, get_partition_mode_state(blockstate), {'new_vertices': n_new, 'warm_started': False}
+
+    blockstate = refine_warm_start(blockstate, max_sweeps)
+    pmode = get_partition_mode_state(blockstate, pmode_niter)
+    return blockstate, pmode, {'new_vertices': n_new, 'warm_started': True}
+
+
+@profiled
+def run_blockmodel_incremental(positions: pd.DataFrame, state: str, record_type: str, deg_corr: bool, layers: bool,
+                               previous_path: str = None, path: str = None, max_sweeps: int = 100,
+                               pmode_niter: int = 100):
+    """
+    Refit a blockmodel warm-started from a saved one (see fit_blockmodel_incremental) and save it to disk with
+    metadata and partition mode. Falls back to a fit from scratch if there is no saved blockmodel.
+    :param positions: subset of the positions dataframe
+    :param state: the US state
+    :param record_type: 'lobbying' or 'testimony'
+    :param deg_corr: whether to use degree correction
+    :param layers: whether to use layers or categorical labels
+    :param previous_path: the saved blockmodel (.pkl) to start from; defaults to the published one in data/hbsbm
+    :param path: where to save the blockmodel, without extension (see save_blockmodel_and_metadata)
+    :param max_sweeps: see refine_warm_start
+    :param pmode_niter: see fit_blockmodel_incremental
+    :return: the path the blockmodel was saved to
+    """
+    if previous_path is None:
+        previous_path = blockmodel_path(state, record_type, deg_corr, layers) + '.pkl'
+
+    selected_positions = positions[(positions.state == state) & (positions.record_type == record_type)]
+    adj_matrix = get_bipartite_adjacency_matrix(selected_positions, k_core=(5, 5), sparse=True)
+
+    if not os.path.exists(previous_path):
+        print(f"No blockmodel at {previous_path}; fitting from scratch")
+        blockstate, pmode = fit_blockmodel(adj_matrix, deg_corr, layers)
+        return save_blockmodel_and_metadata(blockstate, state, record_type, deg_corr, layers, False, pmode=pmode,
+                                            path=path)
+
+    with open(previous_path, 'rb') as f:
+        old_blockstate = pickle.load(f)
+    blockstate, pmode, warm_start = fit_blockmodel_incremental(adj_matrix, old_blockstate, deg_corr, layers,
+                                                               max_sweeps, pmode_niter, state)
+    return save_blockmodel_and_metadata(blockstate, state, record_type, deg_corr, layers, False, pmode=pmode,
+                                        path=path, warm_start=previous_path, **warm_start)
 
 
 def run_all_blockmodels_from_scratch(positions: pd.DataFrame,
@@ -284,3 +524,139 @@ def run_all_blockmodels_from_scratch(positions: pd.DataFrame,
     for state, record_type in positions[['state', 'record_type']].value_counts().index.values[::-1]:
         print(f"Running {state} {record_type}")
         run_blockmodel_from_scratch(positions, state, record_type, deg_corr, layers, overlap)
+
+
+def _task_seed(seed, state, record_type):
+    """
+    Derive the seed of a single blockmodel fit from a base seed, independently of the order the fits are run in
+    :param seed: int base seed, dict mapping (state, record_type) to seeds, or None
+    :param state: the US state
+    :param record_type: the record type
+    :return: int or None
+    """
+    if seed is None:
+        return None
+    if isinstance(seed, dict):
+        return seed.get((state, record_type))
+    key = zlib.crc32(f"{state}_{record_type}".encode())
+    return int(np.random.SeedSequence([seed, key]).generate_state(1)[0])
+
+
+def _init_worker(omp_threads):
+    """
+    Limit the number of OpenMP threads used by graph-tool in a worker process
+    :param omp_threads: the number of threads, or None to keep the default
+    :return:
+    """
+    if omp_threads is not None:
+        os.environ['OMP_NUM_THREADS'] = str(omp_threads)
+        gt.openmp_set_num_threads(omp_threads)
+
+
+def _run_blockmodel_task(adj_matrix, state, record_type, deg_corr, layers, overlap, seed, path,
+                         warm_start_path=None):
+    """
+    Fit and save a single blockmodel in a worker process, logging its output to {path}.log
+    :param warm_start_path: if given and the file exists, warm-start the fit from this saved blockmodel (see
+        fit_blockmodel_incremental)
+    :return: a dict describing the fit
+    """
+    start = time.time()
+    warm_start = warm_start_path is not None and os.path.exists(warm_start_path)
+    with open(path + '.log', 'w') as log, contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+        print(f"Running {state} {record_type} (seed={seed})")
+        if seed is not None:
+            np.random.seed(seed)
+            gt.seed_rng(seed)
+        if warm_start:
+            with open(warm_start_path, 'rb') as f:
+                old_blockstate = pickle.load(f)
+            blockstate, pmode, info = fit_blockmodel_incremental(adj_matrix, old_blockstate, deg_corr, layers,
+                                                                 state=state)
+            warm_start = info['warm_started']
+            save_blockmodel_and_metadata(blockstate, state, record_type, deg_corr, layers, overlap, pmode=pmode,
+                                         path=path, seed=seed, warm_start=warm_start_path, **info)
+        else:
+            blockstate, pmode = fit_blockmodel(adj_matrix, deg_corr, layers, overlap)
+            save_blockmodel_and_metadata(blockstate, state, record_type, deg_corr, layers, overlap, pmode=pmode,
+                                         path=path, seed=seed)
+        print("Done.")
+
+    return {
+        'state': state,
+        'record_type': record_type,
+        'seed': seed,
+        'path': path,
+        'warm_start': warm_start,
+        'seconds': time.time() - start,
+        'entropy': blockstate.entropy(),
+    }
+
+
+def run_all_blockmodels_in_parallel(positions: pd.DataFrame,
+                                    deg_corr: bool = True,
+                                    layers: bool = False,
+                                    overlap: bool = False,
+                                    n_workers: int = None,
+                                    seed=None,
+                                    largest_first: bool = True,
+                                    omp_threads: int = 1,
+                                    output_dir: str = "data/hbsbm/refits",
+                                    warm_start_dir: str = None):
+    """
+    Run all blockmodels from scratch in a process pool and save them to disk with metadata and partition mode.
+    Each fit is saved to a deterministic path (see blockmodel_path) in output_dir, alongside a .log file with its
+    output.
+    :param positions: the positions dataframe
+    :param deg_corr: see run_blockmodel_from_scratch
+    :param layers: see run_blockmodel_from_scratch
+    :param overlap: see run_blockmodel_from_scratch
+    :param n_workers: the number of worker processes. If None, use one per CPU.
+    :param seed: int base seed from which a seed is derived for each state/record_type, a dict mapping
+        (state, record_type) to seeds, or None for unseeded fits
+    :param largest_first: if True, submit the fits in decreasing order of edge count, so that the longest fits do not
+        start last
+    :param omp_threads: the number of OpenMP threads each worker may use, or None for graph-tool's default
+    :param output_dir: the directory the blockmodels and logs are written to
+    :param warm_start_dir: if given, warm-start each fit from the blockmodel saved at the same path in this directory
+        (e.g. "data/hbsbm" for the published ones), when there is one (see fit_blockmodel_incremental). Warm starts
+        are not used for overlapping blockmodels.
+    :return: a dataframe describing the fits, indexed by state and record type
+    """
+    pathlib.Path(output_dir).mkdir(parents=True, exist_ok=True)
+
+    tasks = []
+    for state, record_type in positions[['state', 'record_type']].value_counts().index.values:
+        selected_positions = positions[(positions.state == state) & (positions.record_type == record_type)]
+        adj_matrix = get_bipartite_adjacency_matrix(selected_positions, k_core=(5, 5), sparse=True)
+        n_edges = np.count_nonzero(adj_matrix.matrix.data)
+        tasks.append((n_edges, state, record_type, adj_matrix))
+
+    if largest_first:
+        tasks = sorted(tasks, key=lambda t: t[0], reverse=True)
+
+    results = []
+    with ProcessPoolExecutor(max_workers=n_workers,
+                             mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_worker,
+                             initargs=(omp_threads,)) as executor:
+        futures = {}
+        for n_edges, state, record_type, adj_matrix in tasks:
+            warm_start_path = None
+            if warm_start_dir is not None and not overlap:
+                warm_start_path = blockmodel_path(state, record_type, deg_corr, layers, warm_start_dir) + '.pkl'
+            future = executor.submit(_run_blockmodel_task, adj_matrix, state, record_type, deg_corr, layers, overlap,
+                                     _task_seed(seed, state, record_type),
+                                     blockmodel_path(state, record_type, deg_corr, layers, output_dir),
+                                     warm_start_path)
+            futures[future] = (state, record_type, n_edges)
+        for future in tqdm.tqdm(as_completed(futures), total=len(futures)):
+            state, record_type, n_edges = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"{state} {record_type} failed: {e!r}")
+                result = {'state': state, 'record_type': record_type, 'error': repr(e)}
+            results.append({**result, 'edges': n_edges})
+
+    return pd.DataFrame(results).set_index(['state', 'record_type'])
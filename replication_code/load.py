@@ -1,89 +1,609 @@
+import functools
+import hashlib
+import json
+import numbers
+import operator
+import os
 import pickle
+import warnings
+from collections import OrderedDict
+from collections.abc import Mapping
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.fs as fs
+import pyarrow.parquet as pq
 
+from config import CLIENT_ID_COL, BILL_ID_COL
+from profiling import profiled
 
-def positions(cache=True):
-    if cache:
-        # Save the positions in RAM
-        if not hasattr(positions, 'positions'):
-            positions.positions = pd.read_parquet('data/positions.parquet')
-        return positions.positions
-    else:
-        return pd.read_parquet('data/positions.parquet')
+# Hive-partitioned copies of the tables written by write_partitioned_datasets. When a table has been converted, it is
+# read from here instead of the flat Parquet file, so that filters on the partition columns only touch one directory.
+PARTITIONED_ROOT = 'data/partitioned'
+# The size and modification time of the flat file a partitioned copy was written from, stored in the copy (pyarrow
+# skips files starting with '_' when reading the dataset)
+PARTITIONED_SOURCE_FILE = '_source.json'
 
+# The partition columns and row sort order of each table
+PARTITIONING = {
+    'positions': ['state', 'record_type'],
+    'bills': ['state'],
+    'clients': ['state'],
+    'block_assignments': ['state', 'record_type'],
+}
+# Columns of repeated strings stored as categoricals, and integer columns downcast, in compact mode
+CATEGORICAL_COLUMNS = [
+    'state', 'record_type', 'position', 'committee', 'lobbyist_firm_name', 'lobbyist_rep_name', 'client_name',
+    'state_client_id', 'state_unified_bill_id', 'source', 'ftm_industry', 'session',
+]
+SMALL_INT_COLUMNS = ['position_numeric', 'year']
+
+SORT_KEYS = {
+    'positions': ['year', 'state_client_id', 'state_unified_bill_id'],
+    'bills': ['state_unified_bill_id'],
+    'clients': ['state_client_id'],
+    'block_assignments': ['entity_id'],
+}
+
+
+def _as_tuple(value):
+    """
+    Normalize a filter or column argument to a hashable tuple (or None)
+    """
+    if value is None:
+        return None
+    if isinstance(value, (str, int)):
+        return (value,)
+    return tuple(value)
+
+
+def _years_range(years):
+    """
+    Normalize a years argument to a (first, last) tuple (or None); a single year is the range (year, year)
+    """
+    if years is None:
+        return None
+    if isinstance(years, numbers.Integral):
+        return (years, years)
+    years = tuple(years)
+    if len(years) != 2:
+        raise ValueError(f"years must be a year or a (first, last) range, not {years!r}")
+    return years
+
+
+def _filter_expression(schema, state=None, record_type=None, years=None):
+    """
+    Build a pyarrow dataset filter from the row predicates
+    :param schema: the schema of the dataset, used to check that the filtered columns exist
+    :param state: tuple of states to keep, or None
+    :param record_type: tuple of record types to keep, or None
+    :param years: (first, last) inclusive range of years to keep, or None; see _years_range
+    :return: pyarrow.compute.Expression or None
+    """
+    expressions = []
+    for column, values in [('state', state), ('record_type', record_type)]:
+        if values is None:
+            continue
+        if column not in schema.names:
+            raise ValueError(f"cannot filter on '{column}': column not in table")
+        expressions.append(pc.field(column).isin(list(values)))
+
+    if years is not None:
+        if 'year' not in schema.names:
+            raise ValueError("cannot filter on 'year': column not in table")
+        first, last = years
+        if first is not None:
+            expressions.append(pc.field('year') >= first)
+        if last is not None:
+            expressions.append(pc.field('year') <= last)
+
+    if not expressions:
+        return None
+    return functools.reduce(operator.and_, expressions)
+
+
+# Files are memory-mapped rather than read into buffers. Processes reading the same files (e.g. main.py --jobs) share
+# the pages of the files in the OS page cache, but each decodes its own copy of the tables it reads.
+_FILESYSTEM = fs.LocalFileSystem(use_mmap=True)
+
+
+def _partitioning(name):
+    return ds.partitioning(pa.schema([(column, pa.string()) for column in PARTITIONING[name]]), flavor='hive')
+
+
+def _source_stat(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def _partitioned_copy_is_current(name):
+    """
+    Whether the partitioned copy of a table was written from the current flat file. A copy without a flat file next
+    to it is current; a copy without a record of its source is not.
+    """
+    flat_path = f'data/{name}.parquet'
+    if not os.path.exists(flat_path):
+        return True
+    source_path = f'{PARTITIONED_ROOT}/{name}/{PARTITIONED_SOURCE_FILE}'
+    if not os.path.exists(source_path):
+        return False
+    with open(source_path) as f:
+        return json.load(f) == _source_stat(flat_path)
+
+
+def _dataset(name):
+    """
+    Open a table as a pyarrow dataset, preferring the hive-partitioned copy if it exists and is up to date with the
+    flat file
+    :param name: 'positions', 'bills', 'clients' or 'block_assignments'
+    :return: pyarrow.dataset.Dataset
+    """
+    partitioned_path = f'{PARTITIONED_ROOT}/{name}'
+    if os.path.isdir(partitioned_path):
+        if _partitioned_copy_is_current(name):
+            return ds.dataset(partitioned_path, format='parquet', partitioning=_partitioning(name),
+                              filesystem=_FILESYSTEM)
+        warnings.warn(f"{partitioned_path} is older than data/{name}.parquet; reading the flat file instead. Run "
+                      f"write_partitioned_datasets(['{name}']) to update it.")
+    return ds.dataset(f'data/{name}.parquet', format='parquet', filesystem=_FILESYSTEM)
 
-def bills(cache=True):
-    if cache:
-        # Save the bills in RAM
-        if not hasattr(bills, 'bills'):
-            bills.bills = pd.read_parquet('data/bills.parquet')
-        return bills.bills
-    else:
-        return pd.read_parquet('data/bills.parquet')
 
+def compact_dataframe(df, name='dataframe', verbose=True):
+    """
+    Convert the repeated string columns of a table to categoricals and downcast its small integer columns, in place.
+    Note that grouping by several categorical columns needs observed=True to skip empty combinations.
+    :param df: the dataframe
+    :param name: the name of the table, used in the memory report
+    :param verbose: whether to print the memory used before and after
+    :return: the dataframe
+    """
+    before = df.memory_usage(deep=True).sum()
 
-def clients(cache=True):
+    for column in CATEGORICAL_COLUMNS:
+        if column in df.columns and not isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype('category')
+
+    for column in SMALL_INT_COLUMNS:
+        if column in df.columns and pd.api.types.is_numeric_dtype(df[column]):
+            if df[column].isna().any():
+                df[column] = df[column].astype(pd.Int16Dtype() if column == 'year' else pd.Int8Dtype())
+            else:
+                df[column] = pd.to_numeric(df[column], downcast='integer')
+
+    if verbose:
+        after = df.memory_usage(deep=True).sum()
+        print(f"{name}: {before / 2 ** 20:,.1f} MB -> {after / 2 ** 20:,.1f} MB")
+    return df
+
+
+# The number of tables (distinct argument combinations) kept in RAM by the loaders; each can be a full table
+CACHE_MAX_TABLES = 4
+
+
+@functools.lru_cache(maxsize=CACHE_MAX_TABLES)
+def _cached_read(name, columns=None, state=None, record_type=None, years=None, compact=False):
+    return _read(name, columns, state, record_type, years, compact)
+
+
+def _read(name, columns=None, state=None, record_type=None, years=None, compact=False):
+    """
+    Read a table, pushing the column selection and row predicates down to pyarrow's dataset scanner so that
+    only the needed columns, row groups and (for partitioned tables) directories are read
+    :return: pd.DataFrame
+    """
+    dataset = _dataset(name)
+    table = dataset.to_table(
+        columns=None if columns is None else list(columns),
+        filter=_filter_expression(dataset.schema, state, record_type, years))
+    df = table.to_pandas()
+    if compact:
+        df = compact_dataframe(df, name)
+    return df
+
+
+def _load_table(name, cache, columns, state, record_type, years, compact=False):
+    """
+    Load a table, optionally from the cache. The cache is keyed on the table name and all of the arguments.
+    """
+    args = (name, _as_tuple(columns), _as_tuple(state), _as_tuple(record_type), _years_range(years), compact)
     if cache:
-        # Save the clients in RAM
-        if not hasattr(clients, 'clients'):
-            clients.clients = pd.read_parquet('data/clients.parquet')
-        return clients.clients
-    else:
-        return pd.read_parquet('data/clients.parquet')
+        return _cached_read(*args)
+    return _read(*args)
+
+
+def clear_cache():
+    """
+    Drop all cached tables from RAM
+    """
+    _cached_read.cache_clear()
+    _with_blocks.cache_clear()
+
+
+def write_partitioned_datasets(names=None, max_rows_per_group=128 * 1024):
+    """
+    One-time conversion of the flat Parquet tables into hive-partitioned datasets in PARTITIONED_ROOT
+    (e.g. data/partitioned/positions/state=WI/record_type=lobbying/), with rows sorted within each partition so that
+    the row group statistics are selective. Once converted, the loaders in this module read the partitioned copies,
+    as long as the flat files have not changed since.
+    :param names: the tables to convert; defaults to all tables in PARTITIONING
+    :param max_rows_per_group: the maximum number of rows per row group
+    :return:
+    """
+    for name in names or PARTITIONING:
+        print(f"Partitioning {name}")
+        flat_path = f'data/{name}.parquet'
+        source_stat = _source_stat(flat_path)
+        table = ds.dataset(flat_path, format='parquet').to_table()
+        sort_keys = [column for column in PARTITIONING[name] + SORT_KEYS[name] if column in table.schema.names]
+        table = table.sort_by([(column, 'ascending') for column in sort_keys])
+        ds.write_dataset(
+            table,
+            f'{PARTITIONED_ROOT}/{name}',
+            format='parquet',
+            partitioning=_partitioning(name),
+            existing_data_behavior='delete_matching',
+            max_rows_per_group=max_rows_per_group,
+            min_rows_per_group=min(max_rows_per_group, 1024),
+            file_options=ds.ParquetFileFormat().make_write_options(write_statistics=True),
+            # a single writer thread keeps the sorted order of the rows within each file
+            use_threads=False,
+        )
+        with open(f'{PARTITIONED_ROOT}/{name}/{PARTITIONED_SOURCE_FILE}', 'w') as f:
+            json.dump(source_stat, f)
+    clear_cache()
+
+
+@profiled
+def positions(cache=True, columns=None, state=None, record_type=None, years=None, compact=False):
+    """
+    Load the positions table
+    :param cache: whether to save the result in RAM; the cache is keyed on the other arguments
+    :param columns: the columns to read, or None for all
+    :param state: a state or list of states to keep, or None for all
+    :param record_type: a record type or list of record types to keep, or None for all
+    :param years: (first, last) inclusive range of years to keep, a single year, or None for all; either end of a
+        range can be None
+    :param compact: if True, store repeated strings as categoricals and downcast position_numeric and year
+        (see compact_dataframe), and print the memory saved
+    :return: pd.DataFrame
+    """
+    return _load_table('positions', cache, columns, state, record_type, years, compact)
+
+
+@profiled
+def bills(cache=True, columns=None, state=None, record_type=None, years=None, compact=False):
+    """
+    Load the bills table; see positions for the arguments
+    """
+    return _load_table('bills', cache, columns, state, record_type, years, compact)
+
+
+@profiled
+def clients(cache=True, columns=None, state=None, record_type=None, years=None, compact=False):
+    """
+    Load the clients table; see positions for the arguments
+    """
+    return _load_table('clients', cache, columns, state, record_type, years, compact)
+
 
+def iter_positions(columns=None, state=None, record_type=None, years=None, batch_size=128 * 1024):
+    """
+    Stream the positions table in Parquet record batches instead of reading it into memory at once. Only one batch
+    is held in RAM at a time, so aggregations over the batches (see counts.RecordCounts) run in bounded memory.
+    :param columns: the columns to read, or None for all; state and record_type are always read
+    :param state: a state or list of states to keep, or None for all
+    :param record_type: a record type or list of record types to keep, or None for all
+    :param years: (first, last) inclusive range of years to keep, a single year, or None for all; either end of a
+        range can be None
+    :param batch_size: the maximum number of rows per batch
+    :return: generator of ((state, record_type), pd.DataFrame), with each batch split by state and record type
+    """
+    if columns is not None:
+        columns = list(dict.fromkeys(['state', 'record_type', *columns]))
 
-def blockstates(cache=True):
-    def _blockstate(state, record_type):
-        return pickle.load(
-            open(f"data/hbsbm/{state}_{record_type}_corrected_categorical_blockstate.pkl", 'rb'))
+    dataset = _dataset('positions')
+    batches = dataset.to_batches(
+        columns=columns,
+        filter=_filter_expression(dataset.schema, _as_tuple(state), _as_tuple(record_type), _years_range(years)),
+        batch_size=batch_size)
+
+    for batch in batches:
+        if batch.num_rows == 0:
+            continue
+        # batches of the partitioned dataset hold a single state and record type, but batches of the flat file
+        # can cross a boundary between them
+        df = batch.to_pandas()
+        for key, group in df.groupby(['state', 'record_type'], sort=False):
+            yield key, group
+
+
+# The (state, record_type) combinations for which blockstates were estimated
+BLOCKSTATE_KEYS = [
+    ('MA', 'lobbying'),
+    ('CO', 'lobbying'),
+    ('TX', 'testimony'),
+    ('IA', 'lobbying'),
+    ('MT', 'lobbying'),
+    ('NE', 'lobbying'),
+    ('WI', 'lobbying'),
+    ('CO', 'testimony'),
+    ('MT', 'testimony'),
+    ('AZ', 'testimony'),
+    ('MO', 'testimony'),
+    ('OH', 'testimony'),
+    ('FL', 'testimony'),
+    ('NJ', 'lobbying'),
+    ('IL', 'testimony'),
+    ('MD', 'testimony'),
+    ('KS', 'testimony'),
+    ('SD', 'testimony'),
+    ('RI', 'lobbying'),
+]
+
+
+def blockstate_path(state, record_type):
+    return f"data/hbsbm/{state}_{record_type}_corrected_categorical_blockstate.pkl"
+
+
+@profiled
+def _load_blockstate(state, record_type):
+    with open(blockstate_path(state, record_type), 'rb') as f:
+        return pickle.load(f)
+
+
+class LazyBlockstates(Mapping):
+    """
+    Read-only mapping from (state, record_type) to blockstates that unpickles each blockstate on first access.
+    At most max_resident blockstates are kept in RAM; the least recently used one is dropped when the bound is hit.
+    Listing keys and membership checks never unpickle anything.
+    """
+
+    def __init__(self, keys=None, max_resident=4):
+        self._keys = list(BLOCKSTATE_KEYS if keys is None else keys)
+        self.max_resident = max_resident
+        self._resident = OrderedDict()
+
+    def __getitem__(self, key):
+        if key in self._resident:
+            self._resident.move_to_end(key)
+            return self._resident[key]
+        if key not in self._keys:
+            raise KeyError(key)
+
+        blockstate = _load_blockstate(*key)
+        self._resident[key] = blockstate
+        if self.max_resident is not None:
+            while len(self._resident) > self.max_resident:
+                self._resident.popitem(last=False)
+        return blockstate
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def available(self):
+        """
+        The keys whose blockstate pickle exists on disk
+        :return: list of (state, record_type)
+        """
+        return [key for key in self._keys if os.path.exists(blockstate_path(*key))]
+
+    def resident(self):
+        """
+        The keys whose blockstate is currently held in RAM, from least to most recently used
+        :return: list of (state, record_type)
+        """
+        return list(self._resident)
+
+    def clear(self):
+        self._resident.clear()
+
+
+def blockstates(cache=True, lazy=True, max_resident=4):
+    """
+    Load the blockstates for every state and record type
+    :param cache: whether to keep the mapping in RAM between calls. Only one mapping is kept: a call with a different
+        lazy or max_resident replaces it.
+    :param lazy: if True, return a LazyBlockstates mapping that unpickles each blockstate on first access. If False,
+        unpickle all blockstates up front into a dict.
+    :param max_resident: the maximum number of blockstates a lazy mapping keeps in RAM (None for no bound)
+    :return: a mapping from (state, record_type) to blockstates
+    """
     def _get_all_blockstates():
-        return {
-            (state, record_type): _blockstate(state, record_type)
-            for state, record_type in [
-                ('MA', 'lobbying'),
-                ('CO', 'lobbying'),
-                ('TX', 'testimony'),
-                ('IA', 'lobbying'),
-                ('MT', 'lobbying'),
-                ('NE', 'lobbying'),
-                ('WI', 'lobbying'),
-                ('CO', 'testimony'),
-                ('MT', 'testimony'),
-                ('AZ', 'testimony'),
-                ('MO', 'testimony'),
-                ('OH', 'testimony'),
-                ('FL', 'testimony'),
-                ('NJ', 'lobbying'),
-                ('IL', 'testimony'),
-                ('MD', 'testimony'),
-                ('KS', 'testimony'),
-                ('SD', 'testimony'),
-                ('RI', 'lobbying'),
-            ]
-        }
+        if lazy:
+            return LazyBlockstates(max_resident=max_resident)
+        return {key: _load_blockstate(*key) for key in BLOCKSTATE_KEYS}
 
     if cache:
         # Save the blockstates in RAM
-        if not hasattr(blockstates, 'blockstates'):
+        key = (lazy, max_resident if lazy else None)
+        if getattr(blockstates, 'key', None) != key:
+            # drop the old mapping first, so that its blockstates are not held alongside the new ones
+            blockstates.blockstates = None
             blockstates.blockstates = _get_all_blockstates()
+            blockstates.key = key
         return blockstates.blockstates
     else:
         return _get_all_blockstates()
 
-def block_assignments(cache=True):
 
-    def _load_block_assignments():
-        df = pd.read_parquet('data/block_assignments.parquet')
-        # convert stringified integer column names to integers
-        df.columns = [int(col) if col.isnumeric() else col for col in df.columns]
-        return df
+@profiled
+def block_assignments(cache=True, state=None, record_type=None):
+    """
+    Load the block assignments table
+    :param cache: whether to save the result in RAM; the cache is keyed on the other arguments
+    :param state: a state or list of states to keep, or None for all
+    :param record_type: a record type or list of record types to keep, or None for all
+    :return: pd.DataFrame
+    """
+    df = _load_table('block_assignments', cache, None, state, record_type, None)
+    # convert stringified integer column names to integers
+    df.columns = [int(col) if str(col).isnumeric() else col for col in df.columns]
+    return df
+
+
+def _file_sha256(path, chunk_size=2 ** 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
 
-    # load the block assignments (data/block_assignments.csv)
+def _blockstate_fingerprints(keys, manifest):
+    """
+    Content hashes of the blockstate pickles. A hash recorded in the manifest is reused when the size and
+    modification time of the file have not changed, so unchanged pickles are not re-read.
+    :param keys: the (state, record_type) keys
+    :param manifest: the previous manifest, as written by materialize_block_assignments
+    :return: dict mapping 'state_record_type' to {'sha256', 'size', 'mtime'}
+    """
+    fingerprints = {}
+    for state, record_type in keys:
+        path = blockstate_path(state, record_type)
+        stat = os.stat(path)
+        previous = manifest.get(f'{state}_{record_type}', {})
+        if previous.get('size') == stat.st_size and previous.get('mtime') == stat.st_mtime:
+            sha256 = previous['sha256']
+        else:
+            sha256 = _file_sha256(path)
+        fingerprints[f'{state}_{record_type}'] = {'sha256': sha256, 'size': stat.st_size, 'mtime': stat.st_mtime}
+    return fingerprints
+
+
+def _blockstate_assignments(blockstate, state, record_type):
+    """
+    The block of every vertex of a blockstate at every level of the hierarchy
+    :return: pd.DataFrame with columns entity_id, one column per level, state and record_type
+    """
+    names = np.array(list(blockstate.g.vp.name), dtype=object)
+    blocks_df = pd.DataFrame({
+        str(level): [f'{state}_{record_type}_{b}' for b in blockstate.project_partition(level, 0).a]
+        for level in range(len(blockstate.levels))
+    })
+    # add state to entity_id because blockmodels were run separately for each state
+    # and did not use unique entity_ids across states
+    blocks_df.insert(0, 'entity_id', state + '_' + names.astype(str))
+    blocks_df['state'] = state
+    blocks_df['record_type'] = record_type
+    return blocks_df
+
+
+@profiled
+def materialize_block_assignments(blockstate_map=None, path='data/block_assignments.parquet',
+                                  manifest_path='data/block_assignments_manifest.json', adopt_existing=True):
+    """
+    Build data/block_assignments.parquet from the blockstates, incrementally. A manifest records a content hash of
+    each blockstate pickle; only the (state, record_type) slices whose pickle changed are recomputed, and the others
+    are copied from the existing file. Each slice is written as its own row group.
+    :param blockstate_map: mapping from (state, record_type) to blockstates, as returned by blockstates()
+    :param path: the block assignments file
+    :param manifest_path: the manifest of blockstate hashes
+    :param adopt_existing: if the block assignments file exists but there is no manifest (e.g. the file downloaded
+        from the Dataverse), treat the existing file as up to date with the current pickles instead of rebuilding it
+    :return: the block assignments, as returned by block_assignments()
+    """
+    if blockstate_map is None:
+        blockstate_map = blockstates()
+    keys = [key for key in blockstate_map.keys() if os.path.exists(blockstate_path(*key))]
+
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    fingerprints = _blockstate_fingerprints(keys, manifest)
+
+    if os.path.exists(path) and not manifest and adopt_existing:
+        manifest = fingerprints
+
+    existing = {}
+    if os.path.exists(path):
+        existing = dict(tuple(pd.read_parquet(path).groupby(['state', 'record_type'])))
+
+    slices = []
+    changed = False
+    for state, record_type in keys:
+        key = f'{state}_{record_type}'
+        up_to_date = manifest.get(key, {}).get('sha256') == fingerprints[key]['sha256']
+        if up_to_date and (state, record_type) in existing:
+            slices.append(existing[(state, record_type)].dropna(axis=1, how='all'))
+        else:
+            print(f"Computing block assignments for {state} {record_type}")
+            slices.append(_blockstate_assignments(blockstate_map[(state, record_type)], state, record_type))
+            changed = True
+    changed = changed or set(existing) != set(keys)
+
+    if changed:
+        n_levels = max(sum(str(c).isnumeric() for c in s.columns) for s in slices)
+        columns = ['entity_id', *map(str, range(n_levels)), 'state', 'record_type']
+        schema = pa.schema([(c, pa.string()) for c in columns])
+        tmp_path = path + '.tmp'
+        with pq.ParquetWriter(tmp_path, schema) as writer:
+            for s in slices:
+                writer.write_table(pa.Table.from_pandas(s.reindex(columns=columns), schema=schema,
+                                                        preserve_index=False))
+        os.replace(tmp_path, path)
+
+        if os.path.isdir(f'{PARTITIONED_ROOT}/block_assignments'):
+            write_partitioned_datasets(['block_assignments'])
+        clear_cache()
+
+    with open(manifest_path, 'w') as f:
+        json.dump(fingerprints, f, indent=1)
+
+    return block_assignments()
+
+
+def join_block_levels(table, id_column, block_levels, prefix='block_level_'):
+    """
+    Add a column with the block of each row's entity at every level of the hierarchy, in one vectorized join
+    :param table: the clients or bills dataframe
+    :param id_column: the column of table holding the entity ids (CLIENT_ID_COL or BILL_ID_COL)
+    :param block_levels: dataframe indexed by entity id with one column per level
+    :param prefix: prefix of the added columns, followed by the level
+    :return: a copy of table with one column per level; the index of table is kept
+    """
+    return table.join(block_levels.rename(columns=lambda level: f'{prefix}{level}'), on=id_column)
+
+
+@functools.lru_cache(maxsize=32)
+def _with_blocks(name, state, record_type):
+    id_column = CLIENT_ID_COL if name == 'clients' else BILL_ID_COL
+    table = _load_table(name, True, None, state, None, None)
+    block_levels = block_assignments(state=state, record_type=record_type)
+    block_levels = block_levels.drop(columns=['state', 'record_type']).set_index('entity_id')
+    return join_block_levels(table, id_column, block_levels.dropna(axis=1, how='all'))
+
+
+@profiled
+def clients_with_blocks(state, record_type, cache=True):
+    """
+    The clients of a state, with a block_level_{level} column for each level of the (state, record_type) blockmodel
+    :param state: the US state
+    :param record_type: the record type of the blockmodel
+    :param cache: whether to save the result in RAM, per state and record type. Cached frames are shared, so copy
+        before modifying.
+    :return: pd.DataFrame
+    """
     if cache:
-        # Save the block assignments in RAM
-        if not hasattr(block_assignments, 'block_assignments'):
-            block_assignments.block_assignments = _load_block_assignments()
-        return block_assignments.block_assignments
-    else:
-        return _load_block_assignments()
+        return _with_blocks('clients', state, record_type)
+    return _with_blocks.__wrapped__('clients', state, record_type)
+
+
+@profiled
+def bills_with_blocks(state, record_type, cache=True):
+    """
+    The bills of a state, with a block_level_{level} column for each level of the (state, record_type) blockmodel;
+    see clients_with_blocks
+    """
+    if cache:
+        return _with_blocks('bills', state, record_type)
+    return _with_blocks.__wrapped__('bills', state, record_type)
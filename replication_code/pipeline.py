@@ -0,0 +1,358 @@
+# A small stage runner for main(). Each stage declares the stages and data files it reads and the files it writes.
+# The result of a stage is cached under a hash of its code (the stage function and every source file of the
+# pipeline), its data files and the hashes of its input stages, so a stage is only rerun when one of these changed (or
+# one of its output files is missing).
+import hashlib
+import inspect
+import json
+import marshal
+import multiprocessing
+import os
+import pathlib
+import pickle
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Callable, NamedTuple
+
+import pandas as pd
+import pyarrow as pa
+
+import profiling
+
+
+class Stage(NamedTuple):
+    """
+    A step of the pipeline
+    :param name: the name of the stage, e.g. 'figure_6'
+    :param func: the function computing the stage; the results of the input stages are passed to it as keyword
+        arguments named after the stages
+    :param inputs: the names of the stages whose results func takes
+    :param files: the data files and directories func reads; missing paths are allowed
+    :param outputs: the files func writes
+    """
+    name: str
+    func: Callable
+    inputs: tuple = ()
+    files: tuple = ()
+    outputs: tuple = ()
+
+
+def _file_sha256(path, chunk_size=2 ** 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _fingerprint(path, manifest):
+    """
+    Content hash of a file or directory. A hash recorded in the manifest is reused when the size and modification
+    time of the file have not changed, so unchanged data files are not re-read.
+    :param path: the file or directory
+    :param manifest: dict of previous hashes, keyed by path; updated in place
+    :return: the hash, or None if the path does not exist
+    """
+    path = pathlib.Path(path)
+    if path.is_dir():
+        h = hashlib.sha256()
+        for file in sorted(p for p in path.rglob('*') if p.is_file()):
+            h.update(f'{file.relative_to(path)}:{_fingerprint(file, manifest)}'.encode())
+        return h.hexdigest()
+    if not path.exists():
+        return None
+
+    stat = os.stat(path)
+    previous = manifest.get(str(path), {})
+    if previous.get('size') == stat.st_size and previous.get('mtime') == stat.st_mtime:
+        return previous['sha256']
+    sha256 = _file_sha256(path)
+    manifest[str(path)] = {'sha256': sha256, 'size': stat.st_size, 'mtime': stat.st_mtime}
+    return sha256
+
+
+def _code_version(stage, code_hash):
+    """
+    Hash of the source of the stage function and of the source files of the pipeline
+    :param code_hash: the hash of the source files, see _source_files_hash
+    """
+    try:
+        h = hashlib.sha256(inspect.getsource(stage.func).encode())
+    except OSError:
+        # functions defined interactively have no source file; fall back to their bytecode
+        h = hashlib.sha256(marshal.dumps(stage.func.__code__))
+    h.update(code_hash.encode())
+    return h.hexdigest()
+
+
+def _source_files_hash(code_files):
+    """
+    Hash of the contents of the source files the stages run. Since a stage can call any function of these, any change
+    to them invalidates every stage, rather than relying on each stage to list the code it depends on.
+    :param code_files: the paths of the source files
+    """
+    h = hashlib.sha256()
+    for path in sorted(str(path) for path in code_files):
+        h.update(f'{pathlib.Path(path).name}:{_file_sha256(path)}'.encode())
+    return h.hexdigest()
+
+
+def _topological_order(stages):
+    """
+    :param stages: dict mapping names to stages
+    :return: the stage names, each after all of its inputs
+    """
+    order, visiting = [], set()
+
+    def visit(name):
+        if name in order:
+            return
+        if name in visiting:
+            raise ValueError(f"stage '{name}' depends on itself")
+        visiting.add(name)
+        for input_name in stages[name].inputs:
+            if input_name not in stages:
+                raise ValueError(f"stage '{name}' takes unknown stage '{input_name}'")
+            visit(input_name)
+        visiting.discard(name)
+        order.append(name)
+
+    for name in stages:
+        visit(name)
+    return order
+
+
+def stage_keys(stages, manifest, code_files=()):
+    """
+    The cache key of every stage: a hash of the stage's code version, its data files and the keys of its inputs
+    :param stages: dict mapping names to stages
+    :param manifest: dict of file hashes, see _fingerprint
+    :param code_files: the source files every stage depends on
+    :return: dict mapping stage names to keys
+    """
+    code_hash = _source_files_hash(code_files)
+    keys = {}
+    for name in _topological_order(stages):
+        stage = stages[name]
+        keys[name] = hashlib.sha256(json.dumps({
+            'name': name,
+            'code': _code_version(stage, code_hash),
+            'files': {str(path): _fingerprint(path, manifest) for path in stage.files},
+            'inputs': {input_name: keys[input_name] for input_name in stage.inputs},
+        }, sort_keys=True).encode()).hexdigest()
+    return keys
+
+
+def _upstream(stages, names):
+    """
+    :return: the given stages and all the stages they depend on, directly or not
+    """
+    needed, todo = set(), list(names)
+    while todo:
+        name = todo.pop()
+        if name not in stages:
+            raise ValueError(f"unknown stage '{name}'; stages are {', '.join(stages)}")
+        if name not in needed:
+            needed.add(name)
+            todo.extend(stages[name].inputs)
+    return needed
+
+
+# Stage results are cached as Arrow IPC files if they are dataframes that Arrow can store, and pickled otherwise
+RESULT_SUFFIXES = ('.arrow', '.pkl')
+
+
+def save_result(result, base_path):
+    """
+    Cache the result of a stage
+    :param result: the result
+    :param base_path: the path of the cache file, without suffix
+    :return: the path of the cache file
+    """
+    # Arrow stores column names as strings, so other column names would not survive the round trip
+    if isinstance(result, pd.DataFrame) and all(isinstance(column, str) for column in result.columns):
+        try:
+            table = pa.Table.from_pandas(result)
+        except (pa.ArrowException, TypeError, ValueError):
+            pass
+        else:
+            path = f'{base_path}.arrow'
+            with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+            return path
+
+    path = f'{base_path}.pkl'
+    with open(path, 'wb') as f:
+        pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return path
+
+
+def load_result(path):
+    """
+    Read a cached stage result. Arrow files are read without deserialization, but converting them to pandas still
+    copies the data, so each process reading a result holds its own copy.
+    :param path: the path returned by save_result
+    :return: the result
+    """
+    if str(path).endswith('.arrow'):
+        with pa.memory_map(str(path)) as source:
+            return pa.ipc.open_file(source).read_all().to_pandas()
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+class Pipeline:
+    """
+    Runs stages in dependency order, skipping the stages whose cached result is up to date
+    """
+
+    def __init__(self, stages, cache_dir='data/pipeline_cache', code_files=()):
+        """
+        :param stages: list of Stage
+        :param cache_dir: the directory holding the cached stage results and the file hash manifest
+        :param code_files: the source files the stages depend on (e.g. the script defining them and the modules it
+            uses); a change to any of them invalidates every stage
+        """
+        self.stages = {stage.name: stage for stage in stages}
+        self.cache_dir = pathlib.Path(cache_dir)
+        self.code_files = tuple(code_files)
+        self.manifest_path = self.cache_dir / 'manifest.json'
+        self.profile_records = []
+
+    def _cache_path(self, name, key):
+        """
+        The cached result of a stage, or None if it is not cached
+        """
+        for suffix in RESULT_SUFFIXES:
+            path = self.cache_dir / f'{name}-{key[:16]}{suffix}'
+            if path.exists():
+                return path
+        return None
+
+    def _is_fresh(self, name, key):
+        return self._cache_path(name, key) is not None and all(
+            os.path.exists(path) for path in self.stages[name].outputs)
+
+    def plan(self, only=None, force=False):
+        """
+        Work out which stages have to run
+        :param only: the names of the stages to produce; defaults to all stages
+        :param force: if True, rerun the stages in only (or all stages) even if their results are cached
+        :return: (keys, to_run), where keys maps every needed stage to its cache key and to_run lists the stages to
+            compute, in order
+        """
+        targets = list(self.stages) if only is None else list(only)
+        needed = _upstream(self.stages, targets)
+        needed = {name: stage for name, stage in self.stages.items() if name in needed}
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        manifest = json.loads(self.manifest_path.read_text()) if self.manifest_path.exists() else {}
+        keys = stage_keys(needed, manifest, self.code_files)
+        self.manifest_path.write_text(json.dumps(manifest, indent=2))
+
+        to_run = [
+            name for name in _topological_order(needed)
+            if (force and name in targets) or not self._is_fresh(name, keys[name])
+        ]
+        return keys, to_run
+
+    def run(self, only=None, force=False, jobs=1, profile=None):
+        """
+        Run the stages that are out of date
+        :param only: the names of the stages to produce; defaults to all stages. Their inputs are computed too if
+            they are not cached.
+        :param force: if True, rerun the stages in only (or all stages) even if their results are cached
+        :param jobs: the number of stages to run at once. With more than one job, the stages run in worker processes
+            with the non-interactive Agg matplotlib backend, as soon as their inputs are ready; they read their inputs
+            from the cache rather than having them sent to them.
+        :param profile: if given, a dict of keyword arguments to profiling.enable. Each stage, and the profiled
+            functions it calls, are then profiled, and the records are kept in self.profile_records.
+        :return: dict mapping the names of the stages that were run to their results
+        """
+        keys, to_run = self.plan(only, force)
+        skipped = [name for name in keys if name not in to_run]
+        if skipped:
+            print(f"Up to date: {', '.join(skipped)}")
+
+        base_path = {name: self.cache_dir / f'{name}-{keys[name][:16]}' for name in to_run}
+        for name in to_run:
+            for stale in self.cache_dir.glob(f'{name}-*'):
+                stale.unlink()
+
+        if profile is not None:
+            profiling.enable(**profile)
+            profiling.collect()
+        self.profile_records = []
+
+        try:
+            if jobs == 1:
+                results = {}
+
+                def result(name):
+                    if name not in results:
+                        results[name] = load_result(self._cache_path(name, keys[name]))
+                    return results[name]
+
+                for name in to_run:
+                    stage = self.stages[name]
+                    print(f"Running {name}")
+                    with profiling.profile(name) as record:
+                        results[name] = stage.func(**{input_name: result(input_name) for input_name in stage.inputs})
+                        record['result'] = results[name]
+                    save_result(results[name], base_path[name])
+                    self.profile_records.extend(profiling.collect())
+                return {name: results[name] for name in to_run}
+
+            remaining = list(to_run)
+            running = {}
+            with ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context('spawn'),
+                                     initializer=_init_worker, initargs=(profile,)) as executor:
+                while remaining or running:
+                    for name in [name for name in remaining if not set(self.stages[name].inputs) & set(remaining)]:
+                        if any(input_name in running.values() for input_name in self.stages[name].inputs):
+                            continue
+                        stage = self.stages[name]
+                        print(f"Running {name}")
+                        input_paths = {
+                            input_name: str(self._cache_path(input_name, keys[input_name]))
+                            for input_name in stage.inputs
+                        }
+                        future = executor.submit(_run_stage, name, stage.func, input_paths, str(base_path[name]))
+                        running[future] = name
+                        remaining.remove(name)
+
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        name = running.pop(future)
+                        self.profile_records.extend(future.result())
+                        print(f"Finished {name}")
+
+            return {name: load_result(self._cache_path(name, keys[name])) for name in to_run}
+        finally:
+            if profile is not None:
+                profiling.disable()
+
+    def write_profile_report(self, path):
+        """
+        Write the profiling records of the last run to {path}.json and {path}.csv (see profiling.write_report)
+        """
+        profiling.write_report(self.profile_records, path)
+
+
+def _init_worker(profile):
+    # the workers only save figures to files
+    import matplotlib
+    matplotlib.use('Agg')
+    if profile is not None:
+        profiling.enable(**profile)
+
+
+def _run_stage(name, func, input_paths, base_path):
+    """
+    Run a stage in a worker process, reading its inputs from and writing its result to the cache
+    :return: the profiling records of the stage, if profiling is enabled
+    """
+    with profiling.profile(name) as record:
+        result = func(**{input_name: load_result(path) for input_name, path in input_paths.items()})
+        record['result'] = result
+    save_result(result, base_path)
+    return profiling.collect()
@@ -0,0 +1,212 @@
+# Optional instrumentation of the replication code. When enabled (see enable), each profiled call records its wall
+# time, CPU time, the resident memory (RSS) of the process at its start and end, how much it raised the peak RSS of
+# the process, the tracemalloc peak (with trace_memory=True) and the size of the dataframes it returns. Profiled
+# calls can be nested; each record names its parent. With cprofile_dir set, the outermost profiled calls are also run
+# under cProfile and their stats dumped to {cprofile_dir}/{name}.prof.
+import contextlib
+import cProfile
+import csv
+import datetime
+import functools
+import json
+import os
+import pathlib
+import sys
+import time
+import tracemalloc
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+_settings = {'enabled': False, 'trace_memory': False, 'cprofile_dir': None}
+_records = []
+_stack = []
+
+REPORT_COLUMNS = ['name', 'parent', 'depth', 'pid', 'start', 'wall_seconds', 'cpu_seconds', 'rss_start_mb',
+                  'rss_end_mb', 'peak_rss_increase_mb', 'traced_peak_mb', 'dataframe_rows', 'dataframe_mb']
+
+
+def enable(trace_memory=False, cprofile_dir=None):
+    """
+    Turn on profiling in this process
+    :param trace_memory: whether to trace Python allocations with tracemalloc, to report the peak memory of each
+        call. This slows the code down noticeably.
+    :param cprofile_dir: if given, dump the cProfile stats of each outermost profiled call to this directory
+    :return:
+    """
+    _settings.update(enabled=True, trace_memory=trace_memory, cprofile_dir=cprofile_dir)
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    if cprofile_dir is not None:
+        pathlib.Path(cprofile_dir).mkdir(parents=True, exist_ok=True)
+
+
+def disable():
+    _settings.update(enabled=False, trace_memory=False, cprofile_dir=None)
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def is_enabled():
+    return _settings['enabled']
+
+
+def options():
+    """
+    :return: the keyword arguments to enable profiling in another process the same way as in this one
+    """
+    return {'trace_memory': _settings['trace_memory'], 'cprofile_dir': _settings['cprofile_dir']}
+
+
+def collect():
+    """
+    :return: the records of the profiled calls that finished since the last collect, in order of completion
+    """
+    records = list(_records)
+    _records.clear()
+    return records
+
+
+def _peak_rss_mb():
+    """
+    The highest RSS of the process so far. This only ever grows, so it is reported as the increase over a call.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def _rss_mb():
+    """
+    The current RSS of the process, or None where /proc is not available
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return resident_pages * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+
+
+def dataframe_size(obj):
+    """
+    The number of rows and memory size of a dataframe, or of the dataframes in a tuple, list or dict
+    :return: (rows, MB), or (None, None) if obj holds no dataframes
+    """
+    if isinstance(obj, dict):
+        obj = list(obj.values())
+    if not isinstance(obj, (tuple, list)):
+        obj = [obj]
+    frames = [o for o in obj if isinstance(o, (pd.DataFrame, pd.Series))]
+    if not frames:
+        return None, None
+    n_bytes = sum(float(pd.Series(f.memory_usage(deep=True)).sum()) for f in frames)
+    return sum(len(f) for f in frames), n_bytes / 2 ** 20
+
+
+@contextlib.contextmanager
+def profile(name):
+    """
+    Profile a block of code if profiling is enabled
+    :param name: the name of the record
+    :return: the record, a dict; set record['result'] to a value to have its dataframe size recorded
+    """
+    if not _settings['enabled']:
+        yield {}
+        return
+
+    tracing = _settings['trace_memory'] and tracemalloc.is_tracing()
+    if tracing:
+        # the peak seen by the enclosing call so far is kept before the peak is reset for this call
+        if _stack:
+            _stack[-1]['_peak'] = max(_stack[-1]['_peak'], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+
+    record = {
+        'name': name,
+        'parent': _stack[-1]['name'] if _stack else None,
+        'depth': len(_stack),
+        'pid': os.getpid(),
+        'start': datetime.datetime.now().isoformat(timespec='seconds'),
+        '_peak': 0,
+    }
+    profiler = None
+    if _settings['cprofile_dir'] is not None and not any(r.get('_profiler') for r in _stack):
+        profiler = record['_profiler'] = cProfile.Profile()
+
+    record['rss_start_mb'] = _rss_mb()
+    peak_rss = _peak_rss_mb()
+
+    _stack.append(record)
+    wall, cpu = time.perf_counter(), time.process_time()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield record
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(pathlib.Path(_settings['cprofile_dir']) / f'{name}.prof')
+        record['wall_seconds'] = time.perf_counter() - wall
+        record['cpu_seconds'] = time.process_time() - cpu
+        record['rss_end_mb'] = _rss_mb()
+        record['peak_rss_increase_mb'] = None if peak_rss is None else _peak_rss_mb() - peak_rss
+        if tracing:
+            peak = max(record['_peak'], tracemalloc.get_traced_memory()[1])
+            record['traced_peak_mb'] = peak / 2 ** 20
+            if len(_stack) > 1:
+                _stack[-2]['_peak'] = max(_stack[-2]['_peak'], peak)
+            tracemalloc.reset_peak()
+        else:
+            record['traced_peak_mb'] = None
+        record['dataframe_rows'], record['dataframe_mb'] = dataframe_size(record.pop('result', None))
+
+        _stack.pop()
+        record.pop('_peak')
+        record.pop('_profiler', None)
+        _records.append(record)
+
+
+def profiled(func=None, name=None):
+    """
+    Decorator profiling every call of a function when profiling is enabled, and recording the size of the
+    dataframes it returns
+    :param func: the function
+    :param name: the name of the records; defaults to module.function
+    """
+    if func is None:
+        return functools.partial(profiled, name=name)
+    name = name or f'{func.__module__}.{func.__name__}'
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _settings['enabled']:
+            return func(*args, **kwargs)
+        with profile(name) as record:
+            record['result'] = func(*args, **kwargs)
+            return record['result']
+
+    return wrapper
+
+
+def write_report(records, path):
+    """
+    Write profiling records to {path}.json and {path}.csv
+    :param records: the records, as returned by collect
+    :param path: the path of the report, without suffix; its directory is created if needed
+    :return:
+    """
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(f'{path}.json', 'w') as f:
+        json.dump(records, f, indent=2)
+    with open(f'{path}.csv', 'w', newline='') as f:
+        writer = csv.DictWriter(f, REPORT_COLUMNS, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(records)
@@ -0,0 +1,148 @@
+# Batched client-to-client projections for every state and record type
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from adjacency import projection_matrix, sparse_bipartite_adjacency_matrix
+from config import CLIENT_ID_COL, BILL_ID_COL
+from utils import block_agreement_totals
+
+
+def projection_edgelist(W, agents, directed=False):
+    """
+    Convert a projection matrix to a sparse edge list
+    :param W: sparse projection matrix, as returned by adjacency.projection_matrix
+    :param agents: the agent ids of the rows and columns of W
+    :param directed: if False, W is symmetric and only the upper triangle is kept
+    :return: pd.DataFrame with columns 'source', 'target' and 'weight'
+    """
+    W = W.tocoo()
+    keep = np.ones(W.nnz, dtype=bool) if directed else W.row < W.col
+    agents = np.asarray(agents, dtype=object)
+    return pd.DataFrame({
+        'source': agents[W.row[keep]],
+        'target': agents[W.col[keep]],
+        'weight': W.data[keep],
+    })
+
+
+def _slice_projection(positions, congruence, normalization, k_core):
+    """
+    Project the positions of a single state and record type
+    :return: (W, client ids), or None if no data is left after the k-core filter
+    """
+    try:
+        A = sparse_bipartite_adjacency_matrix(positions, k_core)
+    except AssertionError:
+        return None
+    return projection_matrix(A.matrix, congruence, normalization), A.clients
+
+
+def batch_agent_projections(positions: pd.DataFrame,
+                            congruence='sum',
+                            normalization='cossim',
+                            k_core: tuple = (5, 5),
+                            n_workers: int = 1,
+                            output_path: str = None):
+    """
+    Compute the client-to-client projection (see utils.PositionGraph.agent_projection) of every state and record type
+    in one pass over the positions table. Each slice is restricted to the k-core and giant component of its bipartite
+    adjacency matrix, as in hbsbm.get_bipartite_adjacency_matrix. Unlike agent_projection, pairs with zero weight are
+    not stored.
+    :param positions: the positions dataframe
+    :param congruence: see agent_projection
+    :param normalization: see agent_projection
+    :param k_core: see get_bipartite_adjacency_matrix
+    :param n_workers: the number of processes to project the slices in; 1 runs them in this process
+    :param output_path: if given, write the edge lists of all slices to this Parquet file, with one row group per slice
+    :return: dict mapping (state, record_type) to (W, client ids), where W is a sparse projection matrix
+    """
+    columns = [CLIENT_ID_COL, BILL_ID_COL, 'position_numeric']
+    slices = {
+        key: group[columns]
+        for key, group in positions.groupby(['state', 'record_type'], observed=True)
+    }
+    args = (congruence, normalization, k_core)
+
+    if n_workers == 1:
+        results = {key: _slice_projection(group, *args) for key, group in slices.items()}
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = {key: executor.submit(_slice_projection, group, *args) for key, group in slices.items()}
+            results = {key: future.result() for key, future in futures.items()}
+
+    results = {key: result for key, result in results.items() if result is not None}
+
+    if output_path is not None:
+        directed = normalization == 'directed_prop'
+        schema = pa.schema([
+            ('state', pa.string()), ('record_type', pa.string()),
+            ('source', pa.string()), ('target', pa.string()), ('weight', pa.float64()),
+        ])
+        with pq.ParquetWriter(output_path, schema) as writer:
+            for (state, record_type), (W, clients) in results.items():
+                edgelist = projection_edgelist(W, clients, directed)
+                edgelist.insert(0, 'state', state)
+                edgelist.insert(1, 'record_type', record_type)
+                edgelist[['source', 'target']] = edgelist[['source', 'target']].astype(str)
+                writer.write_table(pa.Table.from_pandas(edgelist, schema=schema, preserve_index=False))
+
+    return results
+
+
+def _slice_block_agreement(positions, blocks, k_core):
+    """
+    Block-level agreement and opposition totals for a single state and record type
+    :return: long dataframe with one row per pair of blocks, or None if no data is left after the k-core filter
+    """
+    try:
+        A = sparse_bipartite_adjacency_matrix(positions, k_core)
+    except AssertionError:
+        return None
+    agree, oppose = block_agreement_totals(A, blocks)
+    table = pd.concat([agree.stack(), oppose.stack()], axis=1)
+    table.columns = ['agree', 'oppose']
+    table.index.names = ['block_1', 'block_2']
+    return table.reset_index()
+
+
+def batch_block_agreement(positions: pd.DataFrame,
+                          block_assignments: pd.DataFrame,
+                          level: int,
+                          k_core: tuple = (5, 5),
+                          n_workers: int = 1):
+    """
+    Coalition-level agreement tables (see utils.block_agreement_totals) for every state and record type with block
+    assignments
+    :param positions: the positions dataframe
+    :param block_assignments: the block assignments dataframe, as returned by load.block_assignments
+    :param level: the block hierarchy level to aggregate clients by
+    :param k_core: see get_bipartite_adjacency_matrix
+    :param n_workers: the number of processes to use; 1 runs in this process
+    :return: long dataframe with columns state, record_type, block_1, block_2, agree and oppose
+    """
+    columns = [CLIENT_ID_COL, BILL_ID_COL, 'position_numeric']
+    tasks = {}
+    for (state, record_type), group in block_assignments.groupby(['state', 'record_type'], observed=True):
+        blocks = group.set_index('entity_id')[level].dropna().to_dict()
+        slice_positions = positions[(positions.state == state) & (positions.record_type == record_type)]
+        slice_positions = slice_positions[slice_positions[CLIENT_ID_COL].isin(list(blocks))][columns]
+        tasks[(state, record_type)] = (slice_positions, blocks, k_core)
+
+    if n_workers == 1:
+        results = {key: _slice_block_agreement(*args) for key, args in tasks.items()}
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = {key: executor.submit(_slice_block_agreement, *args) for key, args in tasks.items()}
+            results = {key: future.result() for key, future in futures.items()}
+
+    tables = []
+    for (state, record_type), table in results.items():
+        if table is not None:
+            table.insert(0, 'state', state)
+            table.insert(1, 'record_type', record_type)
+            tables.append(table)
+    return pd.concat(tables, ignore_index=True)
@@ -0,0 +1,78 @@
+# In-process SQL over the Parquet tables with DuckDB. The tables are registered as views on the Parquet files, so
+# queries read only the columns and row groups they need, spill to disk when they do not fit in memory, and return
+# Arrow tables without building pandas dataframes. Example:
+#   query.query("""
+#       SELECT c.ftm_industry, b.status, count(*) AS n
+#       FROM positions p
+#       JOIN clients c USING (state_client_id)
+#       JOIN bills b USING (state_unified_bill_id)
+#       WHERE p.state = ?
+#       GROUP BY ALL
+#   """, ['WI'])
+import functools
+import os
+
+import duckdb
+import pyarrow as pa
+
+from config import CLIENT_ID_COL, BILL_ID_COL
+from load import PARTITIONED_ROOT, _partitioned_copy_is_current
+
+# The key columns of each table, cast to VARCHAR in the views so that joins between tables compare the same type
+KEY_COLUMNS = {
+    'positions': [CLIENT_ID_COL, BILL_ID_COL],
+    'bills': [BILL_ID_COL],
+    'clients': [CLIENT_ID_COL],
+    'block_assignments': ['entity_id'],
+}
+
+
+def _source(name):
+    """
+    The DuckDB table function reading a table, preferring the hive-partitioned copy if it exists and is up to date
+    (see load.write_partitioned_datasets)
+    """
+    partitioned_path = f'{PARTITIONED_ROOT}/{name}'
+    if os.path.isdir(partitioned_path) and _partitioned_copy_is_current(name):
+        return f"read_parquet('{partitioned_path}/**/*.parquet', hive_partitioning = true)"
+    return f"read_parquet('data/{name}.parquet')"
+
+
+def connect(database=':memory:', memory_limit=None, temp_directory=None, threads=None):
+    """
+    Open a DuckDB connection with a view for each of the tables in KEY_COLUMNS that exists
+    :param database: the DuckDB database file; the default keeps only the views, in memory
+    :param memory_limit: the memory DuckDB may use before spilling to temp_directory, e.g. '4GB'
+    :param temp_directory: where to spill intermediate results that do not fit in memory_limit
+    :param threads: the number of threads to use; defaults to the number of cores
+    :return: duckdb.DuckDBPyConnection
+    """
+    connection = duckdb.connect(database)
+    for setting, value in [('memory_limit', memory_limit), ('temp_directory', temp_directory),
+                           ('threads', threads)]:
+        if value is not None:
+            connection.execute(f"SET {setting} = '{value}'")
+
+    for name, keys in KEY_COLUMNS.items():
+        if not (os.path.isdir(f'{PARTITIONED_ROOT}/{name}') or os.path.exists(f'data/{name}.parquet')):
+            continue
+        casts = ', '.join(f'CAST({key} AS VARCHAR) AS {key}' for key in keys)
+        connection.execute(f"CREATE OR REPLACE VIEW {name} AS SELECT * REPLACE ({casts}) FROM {_source(name)}")
+    return connection
+
+
+@functools.lru_cache(maxsize=1)
+def _default_connection():
+    return connect()
+
+
+def query(sql, parameters=None, connection=None) -> pa.Table:
+    """
+    Run a SQL query over the positions, bills, clients and block_assignments views
+    :param sql: the query; use ? placeholders for parameters
+    :param parameters: the values of the placeholders
+    :param connection: a connection returned by connect; defaults to a shared in-memory connection
+    :return: pyarrow.Table
+    """
+    connection = connection or _default_connection()
+    return connection.execute(sql, parameters).fetch_arrow_table()
@@ -0,0 +1,201 @@
+# Synthetic data with the schema of the CHORUS positions, bills and clients tables, for benchmarking the code at sizes
+# beyond the real data and without downloading it (see benchmarks.py). Clients and bills belong to latent blocks,
+# and the sign of a position depends on the blocks of its client and bill, so the blockmodel and agreement code have
+# structure to find. The numbers of positions per client and per bill are heavy-tailed, as in the real data.
+import pathlib
+
+import numpy as np
+import pandas as pd
+
+from config import CLIENT_ID_COL, BILL_ID_COL
+
+STATES = ('WI', 'TX', 'IL', 'MA', 'NJ', 'CO', 'NE', 'MT', 'IA', 'AZ', 'MD', 'MO', 'RI', 'SD', 'NY', 'OH')
+RECORD_TYPES = ('lobbying', 'testimony')
+# the bill id prefixes of the chambers of each state (see tables.CHAMBERS): a lower chamber (House, or Assembly in
+# the states below) and the Senate, or the unicameral legislature of Nebraska
+BILL_PREFIXES = {'NE': ('LB',), 'WI': ('AB', 'SB'), 'NJ': ('AB', 'SB'), 'NY': ('AB', 'SB')}
+DEFAULT_BILL_PREFIXES = ('HB', 'SB')
+INDUSTRIES = (
+    'Agriculture', 'Communications & Electronics', 'Construction', 'Defense', 'Energy & Natural Resources',
+    'Finance, Insurance & Real Estate', 'General Business', 'Government Agencies/Education/Other', 'Health',
+    'Ideology/Single Issue', 'Labor', 'Lawyers & Lobbyists', 'Transportation',
+)
+# words of the synthetic bill titles; bills on the same latent topic draw most of their words from the same slice
+TITLE_WORDS = (
+    'tax', 'school', 'health', 'insurance', 'energy', 'water', 'election', 'police', 'court', 'firearm', 'abortion',
+    'labor', 'wage', 'housing', 'transportation', 'highway', 'medicaid', 'pharmacy', 'utility', 'solar', 'wind',
+    'mining', 'hunting', 'fishing', 'alcohol', 'tobacco', 'cannabis', 'gaming', 'lottery', 'pension', 'retirement',
+    'veteran', 'broadband', 'privacy', 'data', 'contract', 'procurement', 'licensing', 'nursing', 'hospital',
+    'dental', 'child', 'welfare', 'prison', 'sentencing', 'immigration', 'farm', 'dairy', 'forestry', 'budget',
+)
+
+
+def _heavy_tailed_weights(rng, n, exponent):
+    """
+    Weights of n vertices drawn from a Pareto distribution with the given tail exponent; vertices are sampled in
+    proportion to their weight, so their degrees are heavy-tailed too
+    """
+    weights = rng.pareto(exponent, n) + 1
+    return weights / weights.sum()
+
+
+def synthetic_positions(n_positions: int,
+                        states=STATES,
+                        record_types=RECORD_TYPES,
+                        years: tuple = (2000, 2022),
+                        positions_per_client: float = 20,
+                        positions_per_bill: float = 8,
+                        degree_exponent: float = 1.5,
+                        n_blocks: int = 10,
+                        noise: float = 0.15,
+                        neutral_fraction: float = 0.05,
+                        compact: bool = False,
+                        seed: int = 0,
+                        return_blocks: bool = False):
+    """
+    Generate a positions table with the columns of the real one that the analysis uses
+    :param n_positions: the number of positions (rows)
+    :param states: the states; the positions are split between them with heavy-tailed weights
+    :param record_types: the record types; each client is mostly active in one of them
+    :param years: (first, last) inclusive range of the years of the bills
+    :param positions_per_client: the mean number of positions per client, which sets the number of clients
+    :param positions_per_bill: the mean number of positions per bill, which sets the number of bills
+    :param degree_exponent: the Pareto tail exponent of the numbers of positions per client and per bill; smaller is
+        more heavy-tailed
+    :param n_blocks: the number of latent blocks of clients and of bills in each state
+    :param noise: the probability that a position has the opposite sign to the one its blocks prefer
+    :param neutral_fraction: the fraction of neutral positions (position_numeric == 0)
+    :param compact: if True, store the string columns as categoricals, as load.positions(compact=True) does
+    :param seed: the seed of the random number generator
+    :param return_blocks: if True, also return the latent blocks of the clients and bills
+    :return: the positions dataframe, or (positions, dict mapping client and bill ids to block names) with
+        return_blocks
+    """
+    rng = np.random.default_rng(seed)
+    states, record_types = list(states), list(record_types)
+
+    n_per_state = rng.multinomial(n_positions, _heavy_tailed_weights(rng, len(states), 1.0))
+
+    columns = {name: [] for name in ['state', 'record_type', CLIENT_ID_COL, BILL_ID_COL, 'position_numeric', 'year']}
+    client_ids, bill_ids, blocks = [], [], {}
+    for state_code, (state, n) in enumerate(zip(states, n_per_state)):
+        if n == 0:
+            continue
+        n_clients = max(1, int(n / positions_per_client))
+        n_bills = max(1, int(n / positions_per_bill))
+
+        client_codes = rng.choice(n_clients, n, p=_heavy_tailed_weights(rng, n_clients, degree_exponent))
+        bill_codes = rng.choice(n_bills, n, p=_heavy_tailed_weights(rng, n_bills, degree_exponent))
+
+        # each pair of client and bill blocks supports or opposes, with a tendency towards support as in the data
+        client_blocks = rng.integers(n_blocks, size=n_clients)
+        bill_blocks = rng.integers(n_blocks, size=n_bills)
+        preference = np.where(rng.random((n_blocks, n_blocks)) < 0.6, 1, -1)
+        sign = preference[client_blocks[client_codes], bill_blocks[bill_codes]]
+        sign = np.where(rng.random(n) < noise, -sign, sign)
+        sign = np.where(rng.random(n) < neutral_fraction, 0, sign)
+
+        client_record_type = rng.integers(len(record_types), size=n_clients)
+        record_type_codes = np.where(
+            rng.random(n) < 0.9, client_record_type[client_codes], rng.integers(len(record_types), size=n))
+
+        bill_years = rng.integers(years[0], years[1] + 1, size=n_bills)
+
+        state_client_ids = [f'{state}_{i}' for i in range(n_clients)]
+        # ids in the shape of the real ones, e.g. WI_AB123, from which tables.summary_statistics reads the chamber
+        prefixes = rng.choice(BILL_PREFIXES.get(state, DEFAULT_BILL_PREFIXES), size=n_bills)
+        state_bill_ids = [f'{state}_{prefixes[i]}{i + 1}' for i in range(n_bills)]
+        if return_blocks:
+            blocks.update(zip(state_client_ids, client_blocks.astype(str)))
+            blocks.update(zip(state_bill_ids, (n_blocks + bill_blocks).astype(str)))
+
+        columns['state'].append(np.full(n, state_code))
+        columns['record_type'].append(record_type_codes)
+        columns[CLIENT_ID_COL].append(len(client_ids) + client_codes)
+        columns[BILL_ID_COL].append(len(bill_ids) + bill_codes)
+        columns['position_numeric'].append(sign.astype(np.int8))
+        columns['year'].append(bill_years[bill_codes].astype(np.int16))
+        client_ids.extend(state_client_ids)
+        bill_ids.extend(state_bill_ids)
+
+    columns = {name: np.concatenate(values) for name, values in columns.items()}
+    categories = {'state': states, 'record_type': record_types, CLIENT_ID_COL: client_ids, BILL_ID_COL: bill_ids}
+    positions = pd.DataFrame({
+        name: pd.Categorical.from_codes(values, categories=categories[name]) if name in categories else values
+        for name, values in columns.items()
+    })
+    positions['position'] = positions.position_numeric.map({-1: 'oppose', 0: 'neutral', 1: 'support'}).astype(
+        'category')
+
+    if not compact:
+        for column in ['state', 'record_type', CLIENT_ID_COL, BILL_ID_COL, 'position']:
+            positions[column] = positions[column].astype(str)
+        positions['position_numeric'] = positions.position_numeric.astype(np.int64)
+        positions['year'] = positions.year.astype(np.int64)
+
+    if return_blocks:
+        return positions, blocks
+    return positions
+
+
+def synthetic_bills(positions: pd.DataFrame, words_per_title: int = 6, seed: int = 0):
+    """
+    Generate a bills table for the bills of a (synthetic) positions table, with the columns used by the tables and
+    block descriptors
+    :param positions: the positions dataframe
+    :param words_per_title: the number of words in each title
+    :param seed: the seed of the random number generator
+    :return: the bills dataframe
+    """
+    rng = np.random.default_rng(seed)
+    bills = positions.groupby(BILL_ID_COL, observed=True)[['state', 'year']].first().reset_index()
+
+    # bills with the same latent topic share most of their words
+    n_topics = 10
+    topics = rng.integers(n_topics, size=len(bills))
+    vocabulary = np.array(TITLE_WORDS)
+    own_words = np.array_split(np.arange(len(vocabulary)), n_topics)
+    word_codes = np.where(
+        rng.random((len(bills), words_per_title)) < 0.7,
+        np.array([rng.choice(own_words[t], words_per_title) for t in topics]).reshape(len(bills), words_per_title),
+        rng.integers(len(vocabulary), size=(len(bills), words_per_title)))
+
+    bills['title'] = [' '.join(words) for words in vocabulary[word_codes]]
+    bills['status'] = np.where(rng.random(len(bills)) < 0.25, 'passed', 'introduced')
+    return bills
+
+
+def synthetic_clients(positions: pd.DataFrame, guessed_fraction: float = 0.3, seed: int = 0):
+    """
+    Generate a clients table for the clients of a (synthetic) positions table
+    :param positions: the positions dataframe
+    :param guessed_fraction: the fraction of clients whose industry is marked as guessed (ftm_guessed)
+    :param seed: the seed of the random number generator
+    :return: the clients dataframe
+    """
+    rng = np.random.default_rng(seed)
+    clients = positions.groupby(CLIENT_ID_COL, observed=True)[['state']].first().reset_index()
+    clients['client_name'] = 'Client ' + clients[CLIENT_ID_COL].astype(str)
+    clients['ftm_industry'] = np.array(INDUSTRIES)[rng.integers(len(INDUSTRIES), size=len(clients))]
+    clients['ftm_guessed'] = rng.random(len(clients)) < guessed_fraction
+    return clients
+
+
+def write_synthetic_data(n_positions: int, directory='data/synthetic', seed: int = 0, **kwargs):
+    """
+    Write synthetic positions, bills and clients tables to {directory}/{name}.parquet, laid out like the data
+    directory, so that the loaders can be pointed at them
+    :param n_positions: the number of positions
+    :param directory: the output directory
+    :param seed: the seed of the random number generator
+    :param kwargs: passed to synthetic_positions
+    :return: the output directory
+    """
+    directory = pathlib.Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    positions = synthetic_positions(n_positions, seed=seed, **kwargs)
+    positions.to_parquet(directory / 'positions.parquet', index=False)
+    synthetic_bills(positions, seed=seed).to_parquet(directory / 'bills.parquet', index=False)
+    synthetic_clients(positions, seed=seed).to_parquet(directory / 'clients.parquet', index=False)
+    return directory
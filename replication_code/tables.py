@@ -0,0 +1,143 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from scipy.special import xlogy
+
+from config import CLIENT_ID_COL, BILL_ID_COL
+
+CHAMBERS = {
+    'S': 'Senate',
+    'H': 'House',
+    'A': 'Assembly',
+    'L': 'Unicameral'
+}
+
+
+def incidence_matrix(positions: pd.DataFrame):
+    """
+    Sparse client x bill incidence matrix, with a one wherever a client recorded any position on a bill
+    :param positions: the positions dataframe
+    :return: (I, clients, bills), where I is a CSR matrix and clients and bills are the ids of its rows and columns
+    """
+    selection = positions[
+        positions[CLIENT_ID_COL].notna() & positions[BILL_ID_COL].notna() & positions.position_numeric.notna()]
+    client_codes, clients = pd.factorize(selection[CLIENT_ID_COL], sort=True)
+    bill_codes, bills = pd.factorize(selection[BILL_ID_COL], sort=True)
+    I = sp.csr_matrix((np.ones(len(selection)), (client_codes, bill_codes)), shape=(len(clients), len(bills)))
+    # repeated positions of a client on a bill count once
+    I.data[:] = 1
+    return I, clients, bills
+
+
+def _entropy(counts: sp.csr_matrix):
+    """
+    Entropy of each column of a sparse matrix of counts
+    :return: array with one entropy per column, NaN for empty columns
+    """
+    counts = sp.csc_matrix(counts)
+    counts.eliminate_zeros()
+    column = np.repeat(np.arange(counts.shape[1]), np.diff(counts.indptr))
+    totals = np.asarray(counts.sum(0)).ravel()
+    p = counts.data / totals[column]
+    column_sums = np.bincount(column, weights=xlogy(p, p), minlength=counts.shape[1])
+    return np.where(np.diff(counts.indptr) > 0, -column_sums, np.nan)
+
+
+def block_entropy(positions: pd.DataFrame, blocks: dict, kind='bill', incidence=None):
+    """
+    Entropy of the distribution of the positions on each bill over client blocks (kind='bill'), or of the positions
+    of each client over bill blocks (kind='client'), as in Tables 4 and 5
+    :param positions: the positions dataframe
+    :param blocks: dict mapping the ids of the other kind of entity (clients for kind='bill') to their block
+    :param kind: 'bill' or 'client'
+    :param incidence: the output of incidence_matrix(positions), to reuse it across levels
+    :return: pd.Series named '{kind}_entropy', indexed by id and sorted in decreasing order; entities with no
+        positions by entities in blocks are left out
+    """
+    assert kind in ['bill', 'client']
+
+    I, clients, bills = incidence if incidence is not None else incidence_matrix(positions)
+    if kind == 'client':
+        I, clients, bills = I.T.tocsr(), bills, clients
+
+    # rows of I are the entities being grouped into blocks; columns are the entities the entropy is computed for
+    block_of_row = clients.map(blocks)
+    has_block = np.flatnonzero(block_of_row.notna())
+    block_codes, _ = pd.factorize(block_of_row[has_block])
+    M = sp.csr_matrix((np.ones(len(has_block)), (block_codes, has_block)), shape=(block_codes.max(initial=-1) + 1,
+                                                                                 I.shape[0]))
+    counts = M @ I
+
+    entropy = pd.Series(_entropy(counts), index=bills, name=f'{kind}_entropy').dropna()
+    return entropy.sort_values()[::-1]
+
+
+def block_entropies(positions: pd.DataFrame, block_assignments: pd.DataFrame, levels=None):
+    """
+    Bill and client block entropies for every state, record type and block level
+    :param positions: the positions dataframe
+    :param block_assignments: the block assignments dataframe, as returned by load.block_assignments
+    :param levels: the block levels to compute; defaults to all levels of each blockmodel
+    :return: long dataframe with columns state, record_type, level, kind, entity_id and entropy
+    """
+    results = []
+    for (state, record_type), group in block_assignments.groupby(['state', 'record_type'], observed=True):
+        group = group.set_index('entity_id').drop(columns=['state', 'record_type']).dropna(axis=1, how='all')
+        slice_positions = positions[(positions.state == state) & (positions.record_type == record_type)]
+        incidence = incidence_matrix(slice_positions)
+        for level in group.columns if levels is None else levels:
+            blocks = group[level].to_dict()
+            for kind in ['bill', 'client']:
+                entropy = block_entropy(slice_positions, blocks, kind, incidence)
+                results.append(pd.DataFrame({
+                    'state': state,
+                    'record_type': record_type,
+                    'level': level,
+                    'kind': kind,
+                    'entity_id': entropy.index,
+                    'entropy': entropy.values,
+                }))
+    return pd.concat(results, ignore_index=True)
+
+
+def summary_statistics(positions: pd.DataFrame, by=('state', 'record_type'), min_chamber_positions=100):
+    """
+    Summary statistics of the positions in each group, as in Table 1
+    :param positions: the positions dataframe
+    :param by: the column or columns to group by, e.g. ('state', 'record_type'), 'year' or 'committee'
+    :param min_chamber_positions: the number of positions a chamber needs to have in a group to count as covered
+    :return: pd.DataFrame indexed by the grouping keys, with the number of positions of each value of
+        position_numeric (one column per value, in increasing order, NaN where a group has none), then columns
+        percent_neutral, avg_positions_per_bill, years_covered and chambers_covered
+    """
+    by = [by] if isinstance(by, str) else list(by)
+    keys = [positions[column] for column in by]
+
+    stats = positions.groupby(by, observed=True).agg(
+        n_records=('position_numeric', 'size'),
+        n_bills=(BILL_ID_COL, 'nunique'),
+        first_year=('year', 'min'),
+        last_year=('year', 'max'),
+    )
+
+    # values a group has no positions with are NaN, as are the percentages of neutral positions of such groups
+    n_positions = pd.crosstab(keys, positions.position_numeric).reindex(stats.index, fill_value=0).replace(0, np.nan)
+    neutral = n_positions[0] if 0 in n_positions.columns else np.nan
+    percent_neutral = (neutral / n_positions.sum(1, skipna=False) * 100).round(1)
+
+    # the chamber is the first letter of the prefix of the unified bill id, e.g. WI_AB123 -> Assembly
+    chamber = positions[BILL_ID_COL].str.split('_', n=2).str[1].str[0].map(CHAMBERS)
+    covered = pd.crosstab(keys, chamber).reindex(stats.index, fill_value=0) > min_chamber_positions
+    # joins the names of the covered chambers of each group, in alphabetical order
+    if len(covered.columns):
+        chambers_covered = covered.dot(covered.columns + ', ').str[:-2]
+    else:
+        chambers_covered = pd.Series('', index=covered.index)
+
+    table = n_positions.copy()
+    table.columns = list(n_positions.columns)
+    table['percent_neutral'] = percent_neutral
+    table['avg_positions_per_bill'] = (stats.n_records / stats.n_bills).round(1)
+    table['years_covered'] = stats.first_year.astype(str) + '-' + stats.last_year.astype(str)
+    table['chambers_covered'] = chambers_covered
+    return table
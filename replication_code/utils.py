@@ -1,10 +1,17 @@
+import hashlib
+import pathlib
+import pickle
 import textwrap
 
 import matplotlib as mpl
 import networkx as nx
 import numpy as np
+import pandas as pd
+import scipy.sparse as sp
 from matplotlib import pyplot as plt
 
+from adjacency import SparseAdjacency, projection_matrix
+
 
 def plot_bipartite(blockstate, filename=None, nedges=1000, hide_h=0, h_v_size=5.0, h_e_size=1.0, **kwargs):
     """
@@ -162,71 +169,187 @@ def scatter_pie(x0, y0, ax, size, ratios, colors=None, **kwargs):
                    edgecolor='k', **kwargs)
 
 
-def cluster_agreement_plot(
-        B,  # DataFrame: bipartite adjacency matrix
-        c_dict,  # dict: cluster assignments
-        ax=None,
-        relation='agree',
-        highlight=None,
-        edgescale=20,
-):
-    if ax is None:
-        fig, ax = plt.subplots(1, 1, figsize=(10, 10))
+def scatter_pies(centers, sizes, ratios, ax, colors=None, n_points=20, **kwargs):
+    """
+    Batched version of scatter_pie: draw many pie chart markers with one collection per color instead of one scatter
+    call per wedge per pie. Wedges are sized in points, like scatter markers, so the output looks the same as calling
+    scatter_pie for each pie.
+    :param centers: (N, 2) array of pie centers, in data coordinates
+    :param sizes: scalar or (N,) array of marker sizes, as in scatter_pie
+    :param ratios: (N, K) array of the fraction of each pie taken by each of K wedges
+    :param ax: plt.Axes object
+    :param colors: the K wedge colors
+    :param n_points: the number of points on the arc of each wedge
+    :param kwargs: keyword arguments passed to the collections, e.g. zorder
+    :return: list of the K collections
+    """
+    if colors is None:
+        colors = ['powderblue', 'yellowgreen', 'orangered']
 
-    if highlight is None:
-        highlight = [*c_dict.values()]
+    centers = np.atleast_2d(np.asarray(centers, dtype=float))
+    ratios = np.atleast_2d(np.asarray(ratios, dtype=float))
+    sizes = np.broadcast_to(np.asarray(sizes, dtype=float), (len(centers),))
+
+    # (N, K + 1) wedge boundaries, and (N, K, n_points) angles along the arc of every wedge
+    bounds = 2 * np.pi * np.column_stack([np.zeros(len(ratios)), np.cumsum(ratios, axis=1)])
+    t = np.linspace(0, 1, n_points)
+    theta = bounds[:, :-1, None] + (bounds[:, 1:] - bounds[:, :-1])[:, :, None] * t
+
+    # unit-radius wedge outlines starting at the center; scatter scales markers to a half-unit radius
+    verts = np.zeros(theta.shape + (2,))
+    verts = np.concatenate([verts[:, :, :1], np.stack([np.cos(theta), np.sin(theta)], axis=-1)], axis=2) * 0.5
+
+    collections = []
+    for k, color in zip(range(ratios.shape[1]), colors):
+        collection = mpl.collections.PathCollection(
+            [mpl.path.Path(v) for v in verts[:, k]],
+            sizes=sizes,
+            offsets=centers,
+            offset_transform=ax.transData,
+            facecolor=color,
+            edgecolor='k',
+            **kwargs)
+        # as in ax.scatter, the paths are in points and only the offsets are in data coordinates
+        collection.set_transform(mpl.transforms.IdentityTransform())
+        ax.add_collection(collection)
+        collections.append(collection)
+
+    ax.update_datalim(centers)
+    ax.autoscale_view()
+    return collections
+
+
+def block_agreement_totals(B, c_dict):
+    """
+    Total agreement and opposition between and within blocks of agents, computed as M^T W M, where W is the
+    agreement (or opposition) projection of the signed adjacency matrix with 'sum' normalization and M is the
+    agent x block membership indicator matrix. As in the original edge-by-edge aggregation of cluster_agreement_plot,
+    totals between two different blocks count each pair of agents in both directions.
+    :param B: the signed bipartite adjacency matrix, as a DataFrame (NaN where no position) or adjacency.SparseAdjacency
+    :param c_dict: dict mapping agents to blocks; agents not in c_dict are ignored
+    :return: (agree, oppose), two square DataFrames indexed by the blocks that have agents with positions in B.
+        Opposition totals are negative.
+    """
+    if not isinstance(B, SparseAdjacency):
+        B = SparseAdjacency.from_dataframe(B)
 
-    assert isinstance(c_dict, dict)
-    communities = {v: [k for k in c_dict if c_dict[k] == v] for v in set(c_dict.values())}
+    # only agents with at least one non-neutral position are part of the projection
+    has_positions = np.asarray((B.matrix != 0).sum(1)).ravel() > 0
+    in_blocks = B.clients.isin(list(c_dict))
+    rows = np.flatnonzero(has_positions & in_blocks)
+    A = B.matrix[rows]
 
-    pos_graph = PositionGraph()
-    pos_graph.add_positions_from_dataframe(B)
+    block_codes, blocks = pd.factorize(B.clients[rows].map(c_dict), sort=True)
+    M = sp.csr_matrix((np.ones(len(rows)), (np.arange(len(rows)), block_codes)), shape=(len(rows), len(blocks)))
+    double_off_diagonal = 2 - np.eye(len(blocks))
+
+    totals = []
+    for congruence in [1, -1]:
+        W = projection_matrix(A, congruence, 'sum')
+        T = (M.T @ W @ M).toarray() * double_off_diagonal
+        totals.append(pd.DataFrame(T, index=blocks, columns=blocks))
+    return tuple(totals)
+
+
+def cluster_agreement_graph(B, c_dict):
+    """
+    Directed graph of the blocks, with an edge from c1 to c2 weighted by the total agreement between them if c1 < c2
+    and by the total opposition between them if c1 > c2 (see block_agreement_totals)
+    :param B: see block_agreement_totals
+    :param c_dict: see block_agreement_totals
+    :return: nx.DiGraph with a node for every block in c_dict
+    """
+    agree, oppose = block_agreement_totals(B, c_dict)
 
-    """Define agreement and disagreement graphs"""
+    C = nx.DiGraph()
+    C.add_nodes_from(set(c_dict.values()))
+    for c1 in agree.index:
+        for c2 in agree.index:
+            if c1 < c2:
+                C.add_edge(c1, c2, weight=agree.loc[c1, c2])
+            elif c1 > c2:
+                C.add_edge(c1, c2, weight=oppose.loc[c1, c2])
+    return C
 
-    def cluster(G, c):
-        C = nx.Graph()
-        for n in G:
-            C.add_node(n)
 
-        for (u, v, d) in G.edges(data=True):
+def _member_agreement_graph(pos_graph, c_dict):
+    """
+    Graph of the agents in c_dict, with an edge wherever the sum of their cosine-normalized agreement and
+    disagreement is positive
+    :param pos_graph: PositionGraph of the positions
+    :param c_dict: dict mapping agents to clusters
+    :return: nx.Graph
+    """
+    G = nx.Graph()
+    G.add_nodes_from(c_dict.keys())
+    G.add_edges_from(pos_graph.agent_projection('pos_sum', 'cossim').edges(data=True))
+    return G
 
-            w = d['weight']
 
-            if (c[u], c[v]) not in C.edges:
-                C.add_edge(c[u], c[v], weight=0, weights=[])
+def _layout_key(B, c_dict, highlight, seed):
+    """
+    Hash of the inputs of cluster_agreement_layout, used as its cache key
+    """
+    h = hashlib.sha1()
+    h.update(repr((list(B.index), list(B.columns))).encode())
+    h.update(np.ascontiguousarray(B.values, dtype=float).tobytes())
+    h.update(repr(sorted(c_dict.items(), key=str)).encode())
+    h.update(repr(sorted(set(highlight), key=str)).encode())
+    h.update(repr(seed).encode())
+    return h.hexdigest()
 
-            if (c[v], c[u]) not in C.edges:
-                C.add_edge(c[v], c[u], weight=0, weights=[])
 
-            C.edges[c[u], c[v]]['weights'] += [w]
-            C.edges[c[v], c[u]]['weights'] += [w]
+# The entries of a cached layout that cluster_agreement_plot draws, besides the positions, so that it does not have to
+# recompute them from the adjacency matrix
+LAYOUT_DATA_KEYS = ('cluster_nodes', 'cluster_edges', 'member_nodes', 'member_edges', 'position_counts')
 
-        for e in C.edges:
-            C.edges[e]['weight'] = sum(C.edges[e]['weights'])
 
-        return C
+def _graph_from_edgelist(graph_type, nodes, edges):
+    """
+    Rebuild a graph from the node list and (u, v, weight) edge list stored in a layout
+    """
+    G = graph_type()
+    G.add_nodes_from(nodes)
+    G.add_weighted_edges_from(edges)
+    return G
 
-    graphs = {
-        p: cluster(pos_graph.agent_projection(p, 'sum'), c_dict)
-        for p in [1, -1]
-    }
 
-    # Combine them using a directed graph
-    C = nx.DiGraph()
-    C.add_nodes_from(communities)
-    for c1 in communities:
-        for c2 in communities:
-            if c1 < c2:
-                if (c1, c2) in graphs[1].edges:
-                    C.add_edge(c1, c2, weight=graphs[1][c1][c2]['weight'])
-            elif c1 > c2:
-                if (c1, c2) in graphs[-1].edges:
-                    C.add_edge(c1, c2, weight=graphs[-1][c1][c2]['weight'])
+def cluster_agreement_layout(B, c_dict, highlight=None, seed=42, cache_dir='data/layout_cache'):
+    """
+    Compute the node and cluster positions used by cluster_agreement_plot: clusters are placed on a circle, and the
+    members of each cluster are placed around its center with a spring layout. The layout also holds the graphs and
+    position counts that cluster_agreement_plot draws, so that a plot from a cached layout does not recompute them.
+    Results are cached on disk, keyed by a hash of the adjacency matrix, the cluster assignment, the highlighted
+    clusters and the seed.
+    :param B: DataFrame: bipartite adjacency matrix
+    :param c_dict: dict: cluster assignments
+    :param highlight: the clusters to lay out; defaults to all clusters
+    :param seed: the seed of the spring layout
+    :param cache_dir: directory of the layout cache, or None to disable caching
+    :return: dict with 'centers', mapping clusters to coordinates, 'nodes', mapping agents to coordinates, and the
+        entries in LAYOUT_DATA_KEYS: the nodes and weighted edges of the highlighted cluster agreement graph (see
+        cluster_agreement_graph) and member agreement graph, and the numbers of neutral, supporting and opposing
+        positions of each cluster
+    """
+    if highlight is None:
+        highlight = [*c_dict.values()]
+
+    if cache_dir is not None:
+        cache_path = pathlib.Path(cache_dir) / f"{_layout_key(B, c_dict, highlight, seed)}.pkl"
+        if cache_path.exists():
+            with open(cache_path, 'rb') as f:
+                layout = pickle.load(f)
+            # layouts cached before the graphs were stored with them are recomputed
+            if all(key in layout for key in LAYOUT_DATA_KEYS):
+                return layout
+
+    communities = {v: [k for k in c_dict if c_dict[k] == v] for v in set(c_dict.values())}
+
+    pos_graph = PositionGraph()
+    pos_graph.add_positions_from_dataframe(B)
 
-    C = C.subgraph(highlight)
+    C = cluster_agreement_graph(B, c_dict).subgraph(highlight)
 
-    """Calculate positions"""
     centers = nx.circular_layout(C)
 
     idxs = dict(zip(range(len(C)), C))
@@ -237,29 +360,75 @@ def cluster_agreement_plot(
 
     scale = np.pi / (4 * len(communities))
 
-    G_neg = pos_graph.agent_projection(-1, 'cossim')
-    G_pos = pos_graph.agent_projection(1, 'cossim')
-    G = type(G_neg)()
-    G.add_nodes_from(c_dict.keys())
-
-    E_neg = {(e[0], e[1]): e[2]['weight'] for e in G_neg.edges(data=True)}
-    E_pos = {(e[0], e[1]): e[2]['weight'] for e in G_pos.edges(data=True)}
-
-    for e in E_neg.keys() & E_pos.keys():
-        w = E_pos[e] + E_neg[e]
-        if w > 0:
-            G.add_edge(*e, weight=w)
-
-    G = G.subgraph([n for c in highlight for n in communities[c]])
+    G = _member_agreement_graph(pos_graph, c_dict)
 
     pos_f = {}
 
     for c in highlight:
         g = G.subgraph(communities[c])
-        nodepos = nx.spring_layout(g, iterations=20, seed=42)
+        nodepos = nx.spring_layout(g, iterations=20, seed=seed)
         nodepos = nx.rescale_layout_dict(nodepos, scale * 0.75)
         pos_f.update({n: nodepos[n] + centers[c] for n in nodepos})
 
+    G = G.subgraph([n for c in highlight for n in communities[c]])
+
+    # count the neutral, supporting and opposing positions of each coalition
+    counts = pd.concat([(B == j).sum(axis=1) for j in [0, 1, -1]], axis=1)
+    counts = counts.groupby(B.index.map(c_dict)).sum()
+
+    layout = {
+        'centers': centers,
+        'nodes': pos_f,
+        'cluster_nodes': list(C),
+        'cluster_edges': list(C.edges(data='weight')),
+        'member_nodes': list(G),
+        'member_edges': list(G.edges(data='weight')),
+        'position_counts': counts,
+    }
+
+    if cache_dir is not None:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(cache_path, 'wb') as f:
+            pickle.dump(layout, f)
+
+    return layout
+
+
+def cluster_agreement_plot(
+        B,  # DataFrame: bipartite adjacency matrix
+        c_dict,  # dict: cluster assignments
+        ax=None,
+        relation='agree',
+        highlight=None,
+        edgescale=20,
+        layout=None,  # dict: precomputed output of cluster_agreement_layout
+        seed=42,
+        layout_cache_dir='data/layout_cache',
+):
+    if ax is None:
+        fig, ax = plt.subplots(1, 1, figsize=(10, 10))
+
+    if highlight is None:
+        highlight = [*c_dict.values()]
+
+    assert isinstance(c_dict, dict)
+    communities = {v: [k for k in c_dict if c_dict[k] == v] for v in set(c_dict.values())}
+
+    """Calculate positions, and the agreement and disagreement graphs"""
+    # B is only read if the layout is neither given nor cached
+    if layout is None:
+        layout = cluster_agreement_layout(B, c_dict, highlight, seed, layout_cache_dir)
+    elif not all(key in layout for key in LAYOUT_DATA_KEYS):
+        # a layout without the graphs, e.g. computed elsewhere: keep its positions
+        layout = {**cluster_agreement_layout(B, c_dict, highlight, seed, layout_cache_dir),
+                  'centers': layout['centers'], 'nodes': layout['nodes']}
+    centers, pos_f = layout['centers'], layout['nodes']
+
+    C = _graph_from_edgelist(nx.DiGraph, layout['cluster_nodes'], layout['cluster_edges'])
+    G = _graph_from_edgelist(nx.Graph, layout['member_nodes'], layout['member_edges'])
+
+    scale = np.pi / (4 * len(communities))
+
     """Draw the nodes"""
     ax.set_xlim(-1.5, 1.5)
     ax.set_ylim(-1.5, 1.5)
@@ -328,25 +497,17 @@ def cluster_agreement_plot(
     nodes.set_zorder(105)
 
     """Draw the pie charts"""
-    ratios = {}
-    for k in C:
-        members = communities[k]
-        if len(members) == 0:
-            continue
-        ratios[k] = B.reindex(members).stack().dropna().value_counts()
-        for j in [0, -1, 1]:
-            if j not in ratios[k].index:
-                ratios[k].loc[j] = 0
-        ratios[k] = ratios[k].loc[[0, 1, -1]]
-        ratios[k] = (ratios[k].values / sum(ratios[k].values)).reshape(3, )
-
-        scatter_pie(centers[k][0],
-                    centers[k][1],
-                    ax,
-                    node_size * 1.2 ** 2,
-                    ratios[k],
-                    zorder=99,
-                    )
+    counts = layout['position_counts']
+    pies = [k for k in C if k in counts.index]
+    ratios = counts.loc[pies].values
+    ratios = ratios / ratios.sum(1, keepdims=True)
+
+    scatter_pies([centers[k] for k in pies],
+                 node_size * 1.2 ** 2,
+                 ratios,
+                 ax,
+                 zorder=99,
+                 )
 
     """Label the coalitions"""
     for c in centers:
@@ -390,12 +551,68 @@ class PositionGraph(nx.Graph):
         elist = elist[elist[:, 2] != 0]
         self.add_positions_from_edgelist(elist)
 
-    def agent_projection(self, congruence, normalization='cossim', agents=None, bills=None):
+    def agent_projection_matrix(self, congruence, normalization='cossim', agents=None, bills=None):
+        """
+        Sparse linear-algebra version of agent_projection, returning the weights as a matrix
+        (see adjacency.projection_matrix).
+        :param congruence: see agent_projection
+        :param normalization: see agent_projection
+        :param agents: see agent_projection
+        :param bills: see agent_projection
+        :return: (W, agents), where W is a sparse matrix of weights with an empty diagonal and W[i, j] is the weight
+            of the edge from agents[i] to agents[j]
+        """
+        assert congruence in [1, -1, 'sum', 'pos_sum']
+
+        assert normalization in ['sum', 'cossim', 'jaccard', 'directed_prop']
+
+        agent_nodes, bills = self._projection_nodes(agents, bills)
+
+        all_bills = [n[0] for n in self.nodes(data=True) if n[1]['bipartite'] == 1]
+        B = nx.bipartite.biadjacency_matrix(self, agent_nodes, all_bills, weight='weight', format='csr')
+        bill_set = set(bills)
+        columns = [i for i, bill in enumerate(all_bills) if bill in bill_set]
+
+        return projection_matrix(B, congruence, normalization, columns), agent_nodes
+
+    def _projection_nodes(self, agents=None, bills=None):
+        """
+        The agents and bills used in a projection, as in agent_projection
+        :return: (list of agent nodes, list of bills)
+        """
+        if agents is None:
+            agents = [n[0] for n in self.nodes(data=True) if n[1]['bipartite'] == 0]
+
+        if bills is None:
+            bills = [n[0] for n in self.nodes(data=True) if n[1]['bipartite'] == 1]
+
+        return list(set(agents) & set(self.nodes)), bills
+
+    def agent_projection(self, congruence, normalization='cossim', agents=None, bills=None, engine='sparse'):
+        """
+        Construct a one-mode projection of the positions onto the agents, with edge weights measuring how often
+        two agents took the same (congruence=1) or opposite (congruence=-1) positions on the same bills.
+        :param congruence: 1 for agreement, -1 for disagreement, 'sum' for their sum and 'pos_sum' for the positive
+            part of their sum
+        :param normalization: 'sum' for raw counts, 'cossim' to divide by the geometric mean of the agents' degrees,
+            'jaccard' to divide by the size of the union of their neighborhoods and 'directed_prop' to divide by the
+            degree of the source agent (giving a directed graph)
+        :param agents: the agents to include; defaults to all agents
+        :param bills: the bills to count positions on; defaults to all bills
+        :param engine: 'sparse' to compute the weights with sparse matrix products (see agent_projection_matrix),
+            'python' to compare the neighborhoods of every pair of agents
+        :return: nx.Graph, or nx.DiGraph for 'directed_prop'
+        """
 
         assert congruence in [1, -1, 'sum', 'pos_sum']
 
         assert normalization in ['sum', 'cossim', 'jaccard', 'directed_prop']
 
+        assert engine in ['sparse', 'python']
+
+        if engine == 'sparse':
+            return self._agent_projection_sparse(congruence, normalization, agents, bills)
+
         if agents is None:
             agents = [n[0] for n in self.nodes(data=True) if n[1]['bipartite'] == 0]
 
@@ -403,8 +620,8 @@ class PositionGraph(nx.Graph):
             bills = [n[0] for n in self.nodes(data=True) if n[1]['bipartite'] == 1]
 
         if congruence in ('sum', 'pos_sum'):
-            G_neg = self.agent_projection(-1, normalization, agents, bills)
-            G_pos = self.agent_projection(1, normalization, agents, bills)
+            G_neg = self.agent_projection(-1, normalization, agents, bills, engine)
+            G_pos = self.agent_projection(1, normalization, agents, bills, engine)
             G = type(G_neg)()
 
             E_neg = {(e[0], e[1]): e[2]['weight'] for e in G_neg.edges(data=True)}
@@ -458,3 +675,32 @@ class PositionGraph(nx.Graph):
                         G.add_edge(u, v, weight=agfunc(u, v))
 
             return G
+
+    def _agent_projection_sparse(self, congruence, normalization, agents=None, bills=None):
+        """
+        Build the graph returned by agent_projection from agent_projection_matrix. As in the pairwise
+        implementation, every pair of agents gets an edge, including pairs with zero weight (except for
+        congruence='pos_sum', which keeps only positive weights).
+        """
+        W, agent_nodes = self.agent_projection_matrix(congruence, normalization, agents, bills)
+        W = W.toarray()
+        n = len(agent_nodes)
+
+        if normalization == 'directed_prop':
+            G = nx.DiGraph()
+            rows, cols = np.nonzero(~np.eye(n, dtype=bool))
+        else:
+            G = nx.Graph()
+            rows, cols = np.triu_indices(n, 1)
+
+        weights = W[rows, cols]
+        if congruence == 'pos_sum':
+            keep = weights > 0
+            rows, cols, weights = rows[keep], cols[keep], weights[keep]
+        if normalization == 'sum':
+            weights = weights.astype(int)
+
+        G.add_nodes_from(agent_nodes[i] for i in np.unique(np.concatenate([rows, cols])))
+        G.add_weighted_edges_from(zip(map(agent_nodes.__getitem__, rows), map(agent_nodes.__getitem__, cols),
+                                      weights.tolist()))
+        return G
@@ -0,0 +1,145 @@
+# The partition logic of warm-started blockmodel refits (see hbsbm.fit_blockmodel_incremental): mapping the nested
+# partition of a previous fit onto a new graph. It works on plain arrays, so it does not require graph-tool.
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+
+def _place_new_vertices(b, kinds, edges, max_rounds=10, first_new_block=0):
+    """
+    Assign vertices without a block to the block of the same kind whose connections are most similar to theirs. The
+    profile of a vertex counts its supporting and opposing edges to each block; a new vertex joins the block whose
+    summed member profiles have the highest cosine similarity with its own. Vertices whose neighbors are all new are
+    placed in a later round, once their neighbors are.
+    :param b: array of the block of every vertex, -1 for the vertices to place; updated in place
+    :param kinds: array of the kind (0 for clients, 1 for bills) of every vertex
+    :param edges: array of (source, target, weight) rows, with weights in {-1, 1}
+    :param max_rounds: the number of rounds after which the remaining vertices are put in a new block of their kind
+    :param first_new_block: the lowest label the new blocks may take. This is the number of blocks of the previous
+        fit, so that a new block never reuses the label (and so the parents) of a previous block that lost all its
+        vertices.
+    :return: b
+    """
+    n = len(b)
+    source, target, weight = edges[:, 0], edges[:, 1], edges[:, 2]
+    # every edge in both directions
+    u, v, positive = np.r_[source, target], np.r_[target, source], np.r_[weight, weight] > 0
+
+    for _ in range(max_rounds):
+        new = b < 0
+        if not new.any():
+            return b
+        n_blocks = b.max() + 1
+
+        # profiles of all vertices over (neighbor block, sign), counting placed neighbors only
+        placed_edge = b[v] >= 0
+        profiles = sp.csr_matrix(
+            (np.ones(placed_edge.sum()), (u[placed_edge], 2 * b[v[placed_edge]] + positive[placed_edge])),
+            shape=(n, 2 * n_blocks))
+
+        to_place = np.flatnonzero(new & (np.diff(profiles.indptr) > 0))
+        if not len(to_place):
+            break
+
+        placed = np.flatnonzero(~new)
+        membership = sp.csr_matrix((np.ones(len(placed)), (b[placed], placed)), shape=(n_blocks, n))
+        block_profiles = (membership @ profiles).toarray()
+        norms = np.linalg.norm(block_profiles, axis=1)
+        block_profiles /= np.where(norms > 0, norms, 1)[:, None]
+        block_kinds = np.zeros(n_blocks, dtype=kinds.dtype)
+        block_kinds[b[placed]] = kinds[placed]
+        block_sizes = np.bincount(b[placed], minlength=n_blocks)
+
+        scores = np.asarray(profiles[to_place] @ block_profiles.T)
+        # ties, including vertices with no similar block, go to the largest block
+        scores += 1e-9 * block_sizes / max(block_sizes.max(), 1)
+        scores[(kinds[to_place][:, None] != block_kinds[None, :]) | (block_sizes == 0)[None, :]] = -np.inf
+        best = scores.argmax(1)
+        has_candidate = np.isfinite(scores[np.arange(len(to_place)), best])
+        b[to_place[has_candidate]] = best[has_candidate]
+        if not has_candidate.any():
+            break
+
+    # what is left, e.g. new vertices of a kind that has no surviving vertex, gets a new block per kind
+    for kind in np.unique(kinds[b < 0]):
+        b[(b < 0) & (kinds == kind)] = max(b.max() + 1, first_new_block)
+    return b
+
+
+def _check_bipartite_hierarchy(bs, kinds):
+    """
+    Check that no block below the top level of a nested partition holds both clients and bills, as the hard
+    bipartite constraint (pclabel) of the blockmodels requires
+    :param bs: the nested partition
+    :param kinds: the kind of every vertex
+    :return:
+    """
+    # the kinds of the members of each block, as a bitmask: 1 for clients, 2 for bills
+    members = 1 << np.asarray(kinds, dtype=np.int64)
+    for level, b in enumerate(bs[:-1]):
+        block_kinds = np.zeros(b.max() + 1, dtype=np.int64)
+        np.bitwise_or.at(block_kinds, b, members)
+        if (block_kinds == 3).any():
+            raise ValueError(f"blocks {np.flatnonzero(block_kinds == 3).tolist()} of level {level} mix clients and "
+                             f"bills")
+        members = block_kinds
+
+
+def _strip_state_prefix(names, state):
+    """
+    Remove the '{state}_' prefix from the names that have it. The vertex names of the published blockstates lack the
+    prefix that the client and bill ids of the positions table have (see load._blockstate_assignments), so names are
+    compared without it.
+    :param names: the vertex names
+    :param state: the state, or None to leave the names as they are
+    :return: object array of the names
+    """
+    names = pd.Series(np.asarray(names, dtype=object), dtype=object)
+    if state is not None:
+        prefix = f'{state}_'
+        has_prefix = names.str.startswith(prefix).fillna(False).astype(bool)
+        names = names.where(~has_prefix, names.str[len(prefix):])
+    return names.to_numpy(dtype=object)
+
+
+def warm_start_partition(old_names, old_kinds, old_bs, names, kinds, edges, state=None):
+    """
+    Carry the nested partition of a previous fit over to a new graph. Vertices that are in both graphs (matched by
+    kind and by name, ignoring the state prefix) keep their block, new vertices are placed by _place_new_vertices,
+    and the hierarchy above the blocks is copied, with a new parent at each level for every new block.
+    :param old_names: the names of the vertices of the previous graph
+    :param old_kinds: their kinds
+    :param old_bs: the nested partition of the previous fit, as returned by NestedBlockState.get_bs()
+    :param names: the names of the vertices of the new graph
+    :param kinds: their kinds
+    :param edges: the edges of the new graph, as (source, target, weight) rows
+    :param state: the state of both graphs; a leading '{state}_' is stripped from all names before matching
+    :return: (bs, n_new), the nested partition of the new graph and the number of new vertices
+    """
+    old_bs = [np.asarray(b, dtype=np.int64) for b in old_bs]
+    kinds = np.asarray(kinds)
+
+    old_index = pd.MultiIndex.from_arrays([np.asarray(old_kinds), _strip_state_prefix(old_names, state)])
+    index = pd.MultiIndex.from_arrays([kinds, _strip_state_prefix(names, state)])
+    old_vertex = old_index.get_indexer(index)
+
+    b = np.where(old_vertex >= 0, old_bs[0][old_vertex], -1)
+    n_new = int((b < 0).sum())
+    # new blocks are numbered after all the blocks of the previous fit, including those left empty, at every level
+    n_old_blocks = [len(old_b) for old_b in old_bs[1:]] + [old_bs[-1].max(initial=-1) + 1]
+    bs = [_place_new_vertices(b, kinds, np.asarray(edges, dtype=np.int64), first_new_block=n_old_blocks[0])]
+
+    for level, old_b in enumerate(old_bs[1:], start=1):
+        n_children = bs[-1].max() + 1
+        n_added = n_children - len(old_b)
+        if n_added <= 0:
+            bs.append(old_b.copy())
+        elif level == len(old_bs) - 1 and (old_b == 0).all():
+            # the top level has a single block
+            bs.append(np.zeros(n_children, dtype=np.int64))
+        else:
+            first_new_block = max(old_b.max(initial=-1) + 1, n_old_blocks[level])
+            bs.append(np.r_[old_b, first_new_block + np.arange(n_added)])
+
+    _check_bipartite_hierarchy(bs, kinds)
+    return bs, n_new
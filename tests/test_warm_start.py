@@ -0,0 +1,46 @@
+import pathlib
+import sys
+
+import numpy as np
+
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[1] / 'replication_code'))
+
+from warm_start import warm_start_partition  # noqa: E402
+
+
+def _toy_fit():
+    # two clients and two bills, each in its own block of its kind, under a single top block
+    old_names = ['1', '2', 'AB10', 'SB20']
+    old_kinds = np.array([0, 0, 1, 1])
+    old_bs = [np.array([0, 0, 1, 1]), np.array([0, 0])]
+    edges = np.array([[0, 2, 1], [1, 3, -1], [0, 3, 1]])
+    return old_names, old_kinds, old_bs, edges
+
+
+def test_names_differing_only_by_state_prefix_match():
+    old_names, old_kinds, old_bs, edges = _toy_fit()
+    names = ['WI_' + name for name in old_names]
+
+    bs, n_new = warm_start_partition(old_names, old_kinds, old_bs, names, old_kinds, edges, state='WI')
+
+    assert n_new == 0
+    np.testing.assert_array_equal(bs[0], old_bs[0])
+
+
+def test_prefix_is_stripped_on_both_sides():
+    old_names, old_kinds, old_bs, edges = _toy_fit()
+    mixed_old_names = ['WI_1', '2', 'WI_AB10', 'SB20']
+    names = ['1', 'WI_2', 'AB10', 'WI_SB20']
+
+    _, n_new = warm_start_partition(mixed_old_names, old_kinds, old_bs, names, old_kinds, edges, state='WI')
+
+    assert n_new == 0
+
+
+def test_names_do_not_match_without_the_state():
+    old_names, old_kinds, old_bs, edges = _toy_fit()
+    names = ['WI_' + name for name in old_names]
+
+    _, n_new = warm_start_partition(old_names, old_kinds, old_bs, names, old_kinds, edges)
+
+    assert n_new == len(names)